@@ -0,0 +1,296 @@
+#!/usr/bin/env python
+"""
+build and test server benchmarks, run from a source checkout :
+
+    python scripts/bench.py embed [megabytes]
+    python scripts/bench.py pack [megabytes] [threads ...]
+    python scripts/bench.py optimize [count] [jobs]
+    python scripts/bench.py pyc build/web/app.apk [runs]
+    python scripts/bench.py server [requests] [size] [clients]
+"""
+
+import asyncio
+import binascii
+import http.client
+import io
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import zipfile
+from functools import partial
+from http.server import ThreadingHTTPServer
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "src"))
+
+
+def embed(megabytes=8):
+    """size in the utf-8 html page and decode time, previous chr(b+248) encoding against base64"""
+    from pygbag.html_embed import stringify
+
+    # half random like png/ogg, half text like json/svg
+    blob = os.urandom(megabytes << 19) + (b"pygbag " * (megabytes << 17))[: megabytes << 19]
+
+    def o248_encode(data):
+        lines = []
+        for pos in range(0, len(data), 79):
+            lines.append("".join(chr(b + 248) for b in data[pos : pos + 79]))
+        return "\n".join(lines)
+
+    def o248_decode(text, fs):
+        for input in text.split("\n"):
+            if not input:
+                continue
+            fs.write(bytes([ord(c) - 248 for c in input]))
+
+    def b64_encode(data):
+        return "".join(stringify(io.BytesIO(data)))
+
+    def b64_decode(text, fs):
+        fs.write(binascii.a2b_base64(text))
+
+    print(f"{len(blob)} bytes")
+    for name, encode, decode in (("o248", o248_encode, o248_decode), ("base64", b64_encode, b64_decode)):
+        t0 = time.perf_counter()
+        text = encode(blob)
+        encoded = time.perf_counter() - t0
+
+        fs = io.BytesIO()
+        t0 = time.perf_counter()
+        decode(text, fs)
+        decoded = time.perf_counter() - t0
+
+        size = len(text.encode("utf-8"))
+        print(
+            f"    {name:<8} html {size:>10} bytes x{size / len(blob):.2f}   encode {encoded:7.3f}s   decode {decoded:7.3f}s   identical={fs.getvalue() == blob}"
+        )
+
+
+def pack(megabytes=500, *threads):
+    """deflate wall time of a synthetic asset folder for some thread counts"""
+    from pygbag.pack import file_hash, write_members
+
+    threads = threads or (1, 4, 16)
+    with tempfile.TemporaryDirectory() as tmp:
+        root = Path(tmp) / "assets"
+        root.mkdir()
+        words = [bytes(random.choices(b"abcdefghijklmnopqrstuvwxyz", k=random.randint(2, 10))) for _ in range(4096)]
+        text = b" ".join(random.choices(words, k=2 << 20))
+        members = []
+        total = 0
+        while total < megabytes << 20:
+            size = random.randint(1 << 16, 8 << 20)
+            start = random.randint(0, len(text) - size)
+            filename = root / f"asset{len(members)}.txt"
+            filename.write_bytes(text[start : start + size])
+            members.append((filename, f"assets/{filename.name}"))
+            total += size
+
+        print(f"{len(members)} members, {total >> 20} MiB")
+        reference = None
+        for count in threads:
+            apk = Path(tmp) / f"bench-{count}.apk"
+            t0 = time.perf_counter()
+            with zipfile.ZipFile(apk, "w") as zf:
+                write_members(zf, members, threads=count)
+            elapsed = time.perf_counter() - t0
+            digest = file_hash(apk)
+            reference = reference or digest
+            print(f"    threads={count:<3} {elapsed:8.3f}s {total / elapsed / (1 << 20):8.1f} MiB/s   identical={digest == reference}")
+            apk.unlink()
+
+
+def optimize(count=64, jobs=None):
+    """wall time of serial vs parallel optimize() on a synthetic asset tree"""
+    import struct
+    import wave
+    import zlib
+
+    from pygbag.optimizing import optimize
+
+    def png(filename, w=256, h=256):
+        raw = b"".join(b"\0" + random.randbytes(w * 3) for _ in range(h))
+
+        def chunk(tag, data):
+            return struct.pack(">I", len(data)) + tag + data + struct.pack(">I", zlib.crc32(tag + data))
+
+        with open(filename, "wb") as file:
+            file.write(b"\x89PNG\r\n\x1a\n")
+            file.write(chunk(b"IHDR", struct.pack(">IIBBBBB", w, h, 8, 2, 0, 0, 0)))
+            file.write(chunk(b"IDAT", zlib.compress(raw)))
+            file.write(chunk(b"IEND", b""))
+
+    def wav(filename, seconds=2):
+        with wave.open(str(filename), "wb") as file:
+            file.setnchannels(2)
+            file.setsampwidth(2)
+            file.setframerate(44100)
+            file.writeframes(random.randbytes(seconds * 44100 * 4))
+
+    jobs = jobs or os.cpu_count() or 1
+    with tempfile.TemporaryDirectory() as tmp:
+        root = Path(tmp) / "assets"
+        for i in range(count):
+            folder = root / f"level{i % 8}"
+            folder.mkdir(parents=True, exist_ok=True)
+            png(folder / f"sprite{i}.png")
+            if not i % 4:
+                wav(folder / f"sfx{i}.wav")
+        filenames = [Path("/").joinpath(p.relative_to(root)) for p in sorted(root.rglob("*")) if p.is_file()]
+
+        report = {}
+        for run in sorted({1, jobs}):
+            for fp in root.rglob("*-pygbag.*"):
+                fp.unlink()
+            t0 = time.perf_counter()
+            names = list(optimize(root, filenames, cache_dir=Path(tmp) / f"cache-{run}", jobs=run))
+            report[run] = time.perf_counter() - t0
+        print()
+        print(f"{len(filenames)} assets, {len(names)} packed")
+        for run, elapsed in report.items():
+            print(f"    jobs={run:<3} {elapsed:8.3f}s   x{report[1] / elapsed:.2f}")
+        return report
+
+
+def pyc(apkname, runs=5):
+    """
+    simulator startup : time to import every module of an apk in a fresh host python,
+    sources only against sources with the apk __pycache__.
+    """
+    runs = int(runs)
+    with tempfile.TemporaryDirectory() as tmp:
+        modules = []
+        with zipfile.ZipFile(apkname) as zf:
+            names = zf.namelist()
+            for variant in ("source", "pyc"):
+                for name in names:
+                    if variant == "pyc" or name.find("__pycache__/") < 0:
+                        zf.extract(name, Path(tmp) / variant)
+
+        for name in names:
+            if name.startswith("assets/") and name.endswith(".py") and name != "assets/main.py":
+                module = name[7:-3].replace("/", ".")
+                modules.append(module[:-9] if module.endswith(".__init__") else module)
+
+        if not modules:
+            print(f"no importable module in {apkname}")
+            return
+
+        # modules failing to import on host ( eg no pygame ) are still compiled or loaded
+        code = f"""
+import importlib, time
+t0 = time.perf_counter()
+for module in {modules!r}:
+    try:
+        importlib.import_module(module)
+    except Exception:
+        pass
+print(time.perf_counter() - t0)
+"""
+        print(f"{len(modules)} module(s), best of {runs} runs")
+        for variant in ("source", "pyc"):
+            best = None
+            for _ in range(runs):
+                t0 = time.perf_counter()
+                proc = subprocess.run(
+                    [sys.executable, "-B", "-c", code], cwd=Path(tmp) / variant / "assets", stdout=subprocess.PIPE, text=True
+                )
+                total = time.perf_counter() - t0
+                imports = float(proc.stdout.strip().splitlines()[-1])
+                best = min(best or (total, imports), (total, imports))
+            print(f"    {variant:<8} startup {best[0]:8.4f}s   imports {best[1]:8.4f}s")
+
+
+def server(requests=2000, size=64 * 1024, clients=4, depth=16):
+    """
+    requests per second of the thread server against the asyncio one, on local
+    files. Clients keep connections alive when the server allows it, the
+    asyncio server is also tried with depth requests pipelined at once.
+    """
+    import socket
+
+    from pygbag import testserver
+
+    testserver.VERB = False
+    testserver.CDN = testserver.PROXY = "http://127.0.0.1"
+    testserver.BCDN = testserver.BPROXY = testserver.CDN.encode()
+    testserver.CodeHandler.log_message = lambda self, *argv: None
+
+    with tempfile.TemporaryDirectory() as tmp:
+        names = []
+        for i in range(64):
+            names.append(f"/file{i}.bin")
+            Path(tmp, names[-1][1:]).write_bytes(os.urandom(size))
+
+        thread_server = ThreadingHTTPServer(("127.0.0.1", 0), partial(testserver.CodeHandler, directory=tmp))
+        threading.Thread(target=thread_server.serve_forever, daemon=True).start()
+
+        listening = threading.Event()
+        servers = []
+
+        def ready(server):
+            servers.append(server)
+            listening.set()
+
+        threading.Thread(target=asyncio.run, args=(testserver.async_serve(tmp, 0, "127.0.0.1", ready=ready),), daemon=True).start()
+        listening.wait()
+
+        def sequential(port, count):
+            conn = http.client.HTTPConnection("127.0.0.1", port)
+            received = 0
+            for i in range(count):
+                conn.request("GET", names[i % len(names)])
+                received += len(conn.getresponse().read())
+            conn.close()
+            return received
+
+        def pipelined(port, count):
+            sock = socket.create_connection(("127.0.0.1", port))
+            stream = sock.makefile("rb")
+            received = 0
+            for start in range(0, count, depth):
+                batch = range(start, min(count, start + depth))
+                sock.sendall(b"".join(f"GET {names[i % len(names)]} HTTP/1.1\r\nHost: bench\r\n\r\n".encode() for i in batch))
+                for i in batch:
+                    stream.readline()
+                    length = int(http.client.parse_headers(stream)["Content-Length"])
+                    received += len(stream.read(length))
+            sock.close()
+            return received
+
+        runs = (
+            ("thread", thread_server.server_address[1], sequential),
+            ("asyncio", servers[0].sockets[0].getsockname()[1], sequential),
+            ("asyncio pipelined", servers[0].sockets[0].getsockname()[1], pipelined),
+        )
+
+        print(f"{requests} requests of {size} bytes files, {clients} clients")
+        for name, port, client in runs:
+            totals = []
+            workers = [threading.Thread(target=lambda: totals.append(client(port, requests // clients))) for _ in range(clients)]
+            t0 = time.perf_counter()
+            for worker in workers:
+                worker.start()
+            for worker in workers:
+                worker.join()
+            elapsed = time.perf_counter() - t0
+            print(f"    {name:<18} {requests / elapsed:9.0f} req/s {sum(totals) / elapsed / 1e6:9.1f} MB/s")
+
+        thread_server.shutdown()
+
+
+BENCHES = {"embed": embed, "pack": pack, "optimize": optimize, "pyc": pyc, "server": server}
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2 or sys.argv[1] not in BENCHES:
+        print(__doc__)
+        raise SystemExit(1)
+    bench = BENCHES[sys.argv[1]]
+    # all numbers but the apk name
+    argv = [arg if bench is pyc and not idx else int(arg) for idx, arg in enumerate(sys.argv[2:])]
+    bench(*argv)
@@ -9,7 +9,6 @@ import argparse
 
 
 from pathlib import Path
-import hashlib
 
 # import urllib
 import shutil
@@ -28,7 +27,11 @@ if "--no_ssl_check" in sys.argv:
 
 import pygbag
 
+from . import caching
+from . import compressing
 from . import pack
+from . import profiling
+from . import throttling
 from . import web
 from .config_types import Config
 
@@ -138,9 +141,9 @@ def cache_check(app_folder, devmode=False):
 
     clear_cache = False
 
-    # always clear the cache in devmode, because cache source is local and changes a lot
+    # never reuse CDN files in devmode, because cache source is local and changes a lot
     if devmode:
-        print("103: DEVMODE: clearing cache")
+        print("103: DEVMODE: CDN files are not reused across runs")
         clear_cache = True
     elif version_file.is_file():
         try:
@@ -167,22 +170,13 @@ def cache_check(app_folder, devmode=False):
         cache_dir.mkdir(exist_ok=True)
 
     if clear_cache:
-        win32 = sys.platform == "win32"
+        # CDN files now live in the shared user cache, keyed by version.
+        # what remains here is content addressed ( optimizer, pyc ), only
+        # url files of older versions are removed.
         if cache_dir.is_dir():
-            if shutil.rmtree.avoids_symlink_attacks or win32:
-                if win32:
-                    warnings.warn("clear cache : rmtree is not safe on that system (win32)")
-                shutil.rmtree(cache_dir.as_posix())
-            else:
-                print(
-                    "171: cannot clear cache : rmtree is not safe on that system",
-                    file=sys.stderr,
-                )
-                print(
-                    "175: Please remove build folder manually",
-                    file=sys.stderr,
-                )
-                raise SystemExit(115)
+            for legacy in cache_dir.iterdir():
+                if legacy.is_file() and legacy.suffix in (".data", ".head", ".tmpl", ".png"):
+                    legacy.unlink()
 
         # rebuild
         make_cache_dirs()
@@ -273,7 +267,20 @@ async def main_run(app_folder, mainscript, cdn=DEFAULT_CDN):
         help="Specify if window will ask confirmation for closing [default:%s]" % 0,
     )
 
-    parser.add_argument("--cache", default=cache_dir.as_posix(), help="md5 based url cache directory")
+    parser.add_argument("--cache", default=cache_dir.as_posix(), help="app build cache directory ( optimized assets, pycs )")
+
+    parser.add_argument(
+        "--cdn_cache",
+        default=caching.user_cache_dir().as_posix(),
+        help="CDN files cache shared by all apps [default:%s]" % caching.user_cache_dir().as_posix(),
+    )
+
+    parser.add_argument(
+        "--cdn_cache_size",
+        default=caching.LIMIT,
+        type=float,
+        help="CDN cache size limit in MiB, least recently used files are removed above [default:%d]" % caching.LIMIT,
+    )
 
     parser.add_argument(
         "--package",
@@ -299,8 +306,66 @@ async def main_run(app_folder, mainscript, cdn=DEFAULT_CDN):
 
     parser.add_argument("--no_opt", action="store_true", help="turn off assets optimizer")
 
+    parser.add_argument(
+        "--prune_modules",
+        action="store_true",
+        help="leave out python modules never imported from main script, see [MODULES] keep in pygbag.ini for dynamic imports",
+    )
+
+    parser.add_argument(
+        "--dedup",
+        action="store_true",
+        help="pack identical files of 4KiB or more once, the template must call aio.fetch.aliases_mount as the default ones do",
+    )
+
+    parser.add_argument(
+        "--pyc",
+        action="store_true",
+        help="add modules compiled for --PYBUILD to the apk, needs that python version on build host",
+    )
+
+    parser.add_argument(
+        "--pyc_optimize",
+        default=0,
+        type=int,
+        choices=[0, 1, 2],
+        help="optimization level of --pyc, 2 strips docstrings and asserts like -OO [default: 0]",
+    )
+
+    parser.add_argument(
+        "--jobs",
+        default=0,
+        type=int,
+        help="number of concurrent assets optimizer jobs [default: cpu count]",
+    )
+
     parser.add_argument("--archive", action="store_true", help="make build/web.zip archive for itch.io")
 
+    parser.add_argument(
+        "--no_precompress",
+        action="store_true",
+        help="do not write .gz ( and .br with brotli module ) siblings of build/web files",
+    )
+
+    parser.add_argument(
+        "--prefetch",
+        action="store_true",
+        help="download the whole --PYBUILD runtime from cdn in the CDN cache before testing [default:on first use]",
+    )
+
+    parser.add_argument(
+        "--profile-build",
+        action="store_true",
+        help="time build stages and external tools, write sizes and timings to build/build-report.json",
+    )
+
+    parser.add_argument(
+        "--bundle_size",
+        default=0,
+        type=float,
+        help="split assets not needed at startup into bundles of that many MiB, fetched on first use [default: 0, single apk]",
+    )
+
     #    parser.add_argument(
     #        "--main",
     #        default=DEFAULT_SCRIPT,
@@ -338,6 +403,20 @@ async def main_run(app_folder, mainscript, cdn=DEFAULT_CDN):
         help="Specify alternate port [default: 8000]",
     )
 
+    parser.add_argument(
+        "--server",
+        default="thread",
+        choices=["thread", "asyncio"],
+        help="test server, asyncio one keeps connections alive and uses sendfile [default:thread]",
+    )
+
+    parser.add_argument(
+        "--throttle",
+        default=None,
+        help="test server network conditions, one of %s or latency=ms,bandwidth=kbit/s,jitter=ms ; "
+        "with --ume_block 0 time to first frame is printed [default:none]" % ", ".join(throttling.PROFILES),
+    )
+
     parser.add_argument(
         "--disable-sound-format-error",
         action="store_true",
@@ -347,6 +426,12 @@ async def main_run(app_folder, mainscript, cdn=DEFAULT_CDN):
 
     args = parser.parse_args()
 
+    if args.throttle:
+        try:
+            throttling.parse(args.throttle)
+        except ValueError as e:
+            parser.error(str(e))
+
     # when in browser IDE everything should be done in allowed folder
 
     # force build directory in sourcefolder
@@ -355,12 +440,11 @@ async def main_run(app_folder, mainscript, cdn=DEFAULT_CDN):
     # force cache directory to be inside build folder
     args.cache = cache_dir.as_posix()
 
-    app_name = app_folder.name.lower().replace(" ", ".")
-
-    archfile = build_dir.joinpath(f"{app_name}.apk")
+    # CDN files, shared with other apps
+    cdn_cache = caching.CdnCache(args.cdn_cache, f"dev-{datetime.now().timestamp()}" if devmode else VERSION, args.cdn_cache_size)
+    cdn_cache.prune()
 
-    if archfile.is_file():
-        archfile.unlink()
+    app_name = app_folder.name.lower().replace(" ", ".")
 
     print(
         f"""
@@ -429,10 +513,15 @@ now packing application ....
         config: Config = load_config("pygbag.ini")
         ignore_files = config.DEPENDENCIES.ignorefiles
         ignore_dirs = config.DEPENDENCIES.ignoredirs
+        compression = getattr(config, "COMPRESSION", None)
+        compression = {k: getattr(compression, k) for k in ("levels", "threshold") if hasattr(compression, k)}
+        keep_modules = getattr(getattr(config, "MODULES", None), "keep", [])
     else:
         print("WARNING: No pygbag.ini found! See: https://pygame-web.github.io/wiki/pygbag-configuration")
         ignore_files = []
         ignore_dirs = []
+        compression = {}
+        keep_modules = []
 
     for ignore_arr in [ignore_files, ignore_dirs]:
         for ignored in ignore_arr:
@@ -446,13 +535,26 @@ now packing application ....
     print(f"Ignored dirs: {ignore_dirs}")
     print(f"Ignored files: {ignore_files}")
 
-    await pack.archive(f"{app_name}.apk", app_folder, ignore_dirs, ignore_files, build_dir)
-
-    def cache_file(remote_url, suffix):
-        nonlocal cache_dir
-        cache = hashlib.md5(remote_url.encode()).hexdigest()
-        cached = cache_dir.joinpath(cache + "." + suffix)
-        return cached
+    profiling.PROFILE.ENABLED = args.profile_build
+    build_report = app_folder / CACHE_ROOT / "build-report.json"
+
+    await pack.archive(
+        f"{app_name}.apk",
+        app_folder,
+        ignore_dirs,
+        ignore_files,
+        build_dir,
+        cache_dir,
+        jobs=args.jobs,
+        compression=compression,
+        mainscript=DEFAULT_SCRIPT,
+        bundle_size=int(args.bundle_size * 1024 * 1024),
+        pybuild=args.PYBUILD if args.pyc else None,
+        pyc_optimize=args.pyc_optimize,
+        prune_modules=args.prune_modules,
+        keep_modules=keep_modules,
+        dedup=args.dedup,
+    )
 
     # get local or online template in order
     # _______________________________________
@@ -468,8 +570,8 @@ now packing application ....
         )
     else:
         tmpl_url = f"{args.cdn}{args.template}"
-        tmpl = cache_file(tmpl_url, "tmpl")
-        if tmpl.is_file():
+        tmpl = cdn_cache.get(tmpl_url)
+        if tmpl:
             print(
                 f"""
     building from local cached template {args.cdn}{args.template}
@@ -482,13 +584,14 @@ now packing application ....
             print(
                 f"""
     caching template {args.cdn}{args.template}
-    cached locally at {tmpl}
+    cached locally in {cdn_cache.root}
     result files will be in {build_dir}
 """
             )
 
             try:
-                template_file, headers = web.get(tmpl_url, tmpl)
+                with profiling.stage("template fetch"):
+                    template_file, headers = cdn_cache.fetch(tmpl_url, web.get)
             except Exception as e:
                 print(e)
                 print(f"CDN {args.cdn} is not responding : not running test server")
@@ -508,7 +611,7 @@ now packing application ....
     icon_file = Path(args.icon)
     if not icon_file.is_file():
         icon_url = f"{args.cdn}{args.icon}"
-        icon_file = cache_file(icon_url, "png")
+        icon_file = cdn_cache.get(icon_url) or icon_file
 
         if icon_file.is_file():
             print(
@@ -519,7 +622,8 @@ now packing application ....
 
         else:
             try:
-                icon_file, headers = web.get(icon_url, icon_file)
+                with profiling.stage("icon fetch"):
+                    icon_file, headers = cdn_cache.fetch(icon_url, web.get)
                 print(
                     f"""
         caching icon {icon_url}
@@ -535,6 +639,11 @@ now packing application ....
     else:
         print(f"error: cannot find {icon_file=}")
 
+    if args.prefetch:
+        print(f"prefetching python{args.PYBUILD} runtime from {args.cdn}")
+        with profiling.stage("prefetch"):
+            web.prefetch(web.runtime(args.cdn, args.PYBUILD), cdn_cache)
+
     if template_file.is_file():
         with template_file.open("r", encoding="utf-8") as source:
             with open(build_dir.joinpath("index.html").resolve(), "w", encoding="utf-8") as target:
@@ -548,6 +657,10 @@ now packing application ....
 
                     target.write(line)
 
+        if not args.no_precompress:
+            with profiling.stage("precompress"):
+                compressing.siblings(build_dir, args.jobs)
+
         # files should be all ready and tested now
         # except on CDN error on first test, but you did test didn't you ?
         if args.archive:
@@ -560,15 +673,20 @@ now packing application ....
 """
             )
 
-            await pack.web_archive(f"{app_name}.apk", build_dir)
+            with profiling.stage("web_archive"):
+                await pack.web_archive(f"{app_name}.apk", build_dir)
+            profiling.report(build_report)
             return
 
         elif not args.build:
             from . import testserver
 
-            testserver.run_code_server(args, CC)
+            profiling.report(build_report)
+
+            testserver.run_code_server(args, CC, cdn_cache)
 
         else:
+            profiling.report(build_report)
             print(
                 f"""
     build only requested, not running testserver, files ready here :
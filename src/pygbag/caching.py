@@ -0,0 +1,378 @@
+"""
+user level cache of CDN files, shared by all apps and pygbag processes.
+
+entries are content addressed by sha256(version + url) :
+    <root>/cdn/ab/abcd....data    the file
+    <root>/cdn/ab/abcd....head    its http headers
+
+both are written to a temporary name then renamed, head first, so a reader
+seeing .data always gets complete files. Last use is the .head mtime, least
+recently used entries are removed when the cache grows over its size limit,
+with the variants made from them ( abcd....data.gz ).  The .data mtime is the
+time it was downloaded.
+
+the test server proxy goes through stream() : headers and sizes are indexed in
+memory, and a missing url is downloaded once while every client asking for it
+reads the file being written.
+"""
+
+import hashlib
+import os
+import shutil
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+from . import compressing
+
+# default size limit, MiB
+LIMIT = 1024
+
+# check size limit every that many new entries
+PRUNE_EVERY = 32
+
+# a resumable download not touched for that long is abandoned, seconds
+STALE = 3600
+
+
+def parse_headers(text):
+    """[(key, value)] of a .head file, up to the first line not a header"""
+    headers = []
+    for line in text.splitlines():
+        if line.find(": ") <= 0:
+            break
+        k, v = line.strip().split(": ", 1)
+        headers.append((k, v))
+    return headers
+
+
+class Download:
+    """a url being written to the cache"""
+
+    def __init__(self, tmp):
+        self.tmp = tmp
+        # [(key, value)] and Content-Length, once upstream answered
+        self.headers = None
+        self.length = None
+        # bytes written so far
+        self.size = 0
+        self.done = False
+        self.error = None
+        self.cond = threading.Condition()
+
+    def update(self, **kw):
+        with self.cond:
+            for k, v in kw.items():
+                setattr(self, k, v)
+            self.cond.notify_all()
+
+    def wait(self, until):
+        with self.cond:
+            self.cond.wait_for(lambda: until() or self.done or self.error)
+            if self.error:
+                raise self.error
+
+
+class Follower:
+    """file object reading a Download while it is written"""
+
+    def __init__(self, download):
+        self.download = download
+        self.file = open(download.tmp, "rb")
+        self.pos = 0
+
+    def seek(self, pos, whence=0):
+        self.pos = pos if whence == 0 else self.pos + pos
+        return self.pos
+
+    def tell(self):
+        return self.pos
+
+    def read(self, size=-1):
+        download = self.download
+        if size is None or size < 0:
+            download.wait(lambda: False)
+        else:
+            download.wait(lambda: download.size > self.pos)
+        available = download.size - self.pos
+        self.file.seek(self.pos)
+        data = self.file.read(available if size is None or size < 0 else min(size, available))
+        self.pos += len(data)
+        return data
+
+    def close(self):
+        self.file.close()
+
+
+def user_cache_dir():
+    if os.environ.get("PYGBAG_CACHE"):
+        return Path(os.environ["PYGBAG_CACHE"])
+    if sys.platform == "win32":
+        return Path(os.environ.get("LOCALAPPDATA", Path.home() / "AppData" / "Local")) / "pygbag" / "Cache"
+    if sys.platform == "darwin":
+        return Path.home() / "Library" / "Caches" / "pygbag"
+    return Path(os.environ.get("XDG_CACHE_HOME", Path.home() / ".cache")) / "pygbag"
+
+
+class CdnCache:
+    def __init__(self, root=None, version="", limit=LIMIT):
+        self.root = Path(root or user_cache_dir()) / "cdn"
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.version = version
+        self.limit = int(limit * 1024 * 1024)
+        self.stored = 0
+        self.lock = threading.Lock()
+        # key -> ([(key, value)], size), see load_index
+        self.index = {}
+        # url -> Download in progress
+        self.flights = {}
+
+    def key(self, url):
+        return hashlib.sha256(f"{self.version}\0{url}".encode()).hexdigest()
+
+    def paths(self, url):
+        """(data, head) files of url entry, they may not exist"""
+        key = self.key(url)
+        folder = self.root / key[:2]
+        return folder / f"{key}.data", folder / f"{key}.head"
+
+    def tmp(self, path):
+        return path.with_name(f"{path.name}.{os.getpid()}-{threading.get_ident()}.tmp")
+
+    def get(self, url):
+        """data file of url or None, marks entry as recently used"""
+        data, head = self.paths(url)
+        try:
+            data.stat()
+            os.utime(head)
+        except OSError:
+            return None
+        return data
+
+    def headers(self, url):
+        data, head = self.paths(url)
+        try:
+            return head.read_text()
+        except OSError:
+            return ""
+
+    def put(self, url, produced, headers=""):
+        """move produced file in cache as url entry, returns the data file"""
+        data, head = self.paths(url)
+        data.parent.mkdir(exist_ok=True)
+        tmp = self.tmp(head)
+        tmp.write_text(str(headers))
+        os.replace(tmp, head)
+        os.replace(produced, data)
+        self.index[data.stem] = (parse_headers(str(headers)), data.stat().st_size)
+
+        with self.lock:
+            self.stored += 1
+            prune = self.stored % PRUNE_EVERY == 0
+        if prune:
+            self.prune()
+        return data
+
+    def fetch(self, url, retrieve):
+        """
+        data file of url, downloaded when missing with retrieve(url, filename)
+        returning (filename, headers). Concurrent fetches of the same url are
+        safe, the last one to finish wins with identical content.
+        """
+        found = self.get(url)
+        if found:
+            return found, self.headers(url)
+
+        data, head = self.paths(url)
+        data.parent.mkdir(exist_ok=True)
+        tmp = self.tmp(data)
+        try:
+            filename, headers = retrieve(url, tmp)
+            return self.put(url, filename, headers), str(headers)
+        finally:
+            if tmp.exists():
+                tmp.unlink()
+
+    @contextmanager
+    def partial(self, url):
+        """
+        resumable download file of url entry, kept when interrupted, or None
+        while another thread or process is writing it.
+        """
+        data, head = self.paths(url)
+        data.parent.mkdir(exist_ok=True)
+        part = data.with_name(f"{data.name}.part")
+        lock = data.with_name(f"{data.name}.lock")
+        owned = False
+        for attempt in range(2):
+            try:
+                os.close(os.open(lock, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+                owned = True
+                break
+            except FileExistsError:
+                try:
+                    if attempt or lock.stat().st_mtime > time.time() - STALE:
+                        break
+                    lock.unlink()
+                except FileNotFoundError:
+                    pass
+
+        # not in a try block, what is thrown at yield goes to the caller
+        if not owned:
+            yield None
+            return
+        try:
+            yield part
+        finally:
+            lock.unlink()
+
+    def load_index(self):
+        """read all headers and sizes once, returns the number of entries"""
+        for data, st in self.entries():
+            try:
+                self.index[data.stem] = (parse_headers(data.with_suffix(".head").read_text()), st.st_size)
+            except OSError:
+                pass
+        return len(self.index)
+
+    def lookup(self, url):
+        """(open data file, headers, size) of a cached url, or None"""
+        data, head = self.paths(url)
+        entry = self.index.get(data.stem)
+        try:
+            if entry is None:
+                # added since by another process
+                entry = (parse_headers(head.read_text()), data.stat().st_size)
+            file = open(data, "rb")
+        except OSError:
+            self.index.pop(data.stem, None)
+            return None
+        self.index[data.stem] = entry
+        try:
+            os.utime(head)
+        except OSError:
+            pass
+        return (file, *entry)
+
+    def stream(self, url, opener):
+        """
+        (file object, headers, size) of url. A missing url is downloaded only once
+        with opener(url) returning (headers, length, chunks), however many threads
+        ask for it : they all read the file while it is written to the cache.
+        """
+        found = self.lookup(url)
+        if found:
+            return found
+
+        with self.lock:
+            download = self.flights.get(url)
+            if download is None:
+                found = self.lookup(url)
+                if found:
+                    return found
+                data, head = self.paths(url)
+                data.parent.mkdir(exist_ok=True)
+                download = self.flights[url] = Download(self.tmp(data))
+                threading.Thread(target=self.download, args=(url, download, opener), daemon=True).start()
+
+        download.wait(lambda: download.headers is not None)
+        if download.length is not None and not download.done:
+            try:
+                return Follower(download), download.headers, download.length
+            except FileNotFoundError:
+                # just moved in cache
+                pass
+
+        download.wait(lambda: False)
+        return self.lookup(url)
+
+    def download(self, url, download, opener):
+        error = None
+        try:
+            headers, length, chunks = opener(url)
+            with open(download.tmp, "wb") as file:
+                download.update(headers=parse_headers(str(headers)), length=length)
+                for chunk in chunks:
+                    file.write(chunk)
+                    file.flush()
+                    download.update(size=download.size + len(chunk))
+            if length is not None and download.size != length:
+                raise EOFError(f"{url} : {download.size} bytes received, {length} expected")
+            try:
+                self.put(url, download.tmp, headers)
+            except PermissionError:
+                # windows does not move files open by followers
+                copy = self.tmp(download.tmp)
+                shutil.copyfile(download.tmp, copy)
+                self.put(url, copy, headers)
+        except Exception as e:
+            error = e
+            try:
+                download.tmp.unlink()
+            except OSError:
+                pass
+        finally:
+            # gone from flights before waiters wake up, a retry starts a new download
+            with self.lock:
+                self.flights.pop(url, None)
+            download.update(done=True, error=error)
+
+    def entries(self):
+        for folder in self.root.iterdir():
+            if folder.is_dir():
+                for data in folder.glob("*.data"):
+                    try:
+                        yield data, data.stat()
+                    except OSError:
+                        pass
+
+    def prune(self, limit=None):
+        """remove least recently used entries until total size is under limit, returns freed bytes"""
+        limit = self.limit if limit is None else limit
+
+        # left over by interrupted downloads
+        for pattern in ("*/*.tmp", "*/*.part", "*/*.part.if-range"):
+            for tmp in self.root.glob(pattern):
+                try:
+                    if tmp.stat().st_mtime < time.time() - 86400:
+                        tmp.unlink()
+                except OSError:
+                    pass
+
+        def last_use(entry):
+            try:
+                return entry[0].with_suffix(".head").stat().st_mtime
+            except OSError:
+                return entry[1].st_mtime
+
+        def variants(data):
+            # encoded variants only, .part .lock and .tmp files may be in use by another process
+            return [data.with_name(data.name + suffix) for suffix in compressing.SUFFIXES]
+
+        def size(data, st):
+            size = st.st_size
+            for variant in variants(data):
+                try:
+                    size += variant.stat().st_size
+                except OSError:
+                    pass
+            return size
+
+        entries = [(data, size(data, st)) for data, st in sorted(self.entries(), key=last_use)]
+        total = sum(size for data, size in entries)
+        freed = 0
+        for data, size in entries:
+            if total <= limit:
+                break
+            # another process may be pruning too
+            for path in (data, data.with_suffix(".head"), *variants(data)):
+                try:
+                    path.unlink()
+                except OSError:
+                    pass
+            self.index.pop(data.stem, None)
+            total -= size
+            freed += size
+        return freed
@@ -0,0 +1,97 @@
+"""
+bytecode for the apk : app modules compiled ahead of time to
+__pycache__/<name>.cpython-3xx.pyc so the runtime does not compile them at
+each start.
+
+a .pyc only loads on the very python version it was made for, so it is
+produced by a python<PYBUILD> interpreter found on the build host, or not at all.
+pycs use unchecked hashes : mtimes of extracted apk members are meaningless.
+"""
+
+import hashlib
+import json
+import shutil
+import subprocess
+import sys
+import warnings
+from pathlib import Path
+
+from . import profiling
+
+# bump when the way pycs are produced changes, it is part of the cache key
+PYC_VERSION = "1"
+
+COMPILER = """
+import json, py_compile, sys
+for source, pyc, dfile, optimize in json.load(sys.stdin):
+    try:
+        py_compile.compile(source, cfile=pyc, dfile=dfile, doraise=True, optimize=optimize,
+            invalidation_mode=py_compile.PycInvalidationMode.UNCHECKED_HASH)
+    except py_compile.PyCompileError as e:
+        print(e.msg, file=sys.stderr)
+print(sys.implementation.cache_tag)
+"""
+
+
+def interpreter(pybuild):
+    """a python matching PYBUILD ( "3.12" ) version on build host, or None"""
+    if pybuild == "%d.%d" % sys.version_info[:2]:
+        return sys.executable
+    for name in (f"python{pybuild}", f"python{pybuild.replace('.', '')}"):
+        found = shutil.which(name)
+        if not found:
+            continue
+        # version managers shims may exist without the interpreter behind
+        try:
+            proc = subprocess.run([found, "-c", "import sys;print('%d.%d' % sys.version_info[:2])"], capture_output=True, text=True)
+        except OSError:
+            continue
+        if proc.stdout.strip() == pybuild:
+            return found
+    return None
+
+
+def compile_modules(folder, packlist, pybuild, optimize=0, cache_dir=None, mainscript="main.py"):
+    """
+    compile packed .py files, returns [(pyc file, zip name)] members to add to the apk.
+    optimize 2 strips docstrings and asserts but the pyc is still named for a plain
+    python run, the runtime does not use -OO.
+    """
+    python = interpreter(pybuild)
+    if not python:
+        warnings.warn(f"no python{pybuild} found on this host, cannot compile modules for --PYBUILD {pybuild}")
+        return []
+
+    folder = Path(folder)
+    cache = Path(cache_dir or folder / "build" / "web-cache") / "pyc"
+    cache.mkdir(parents=True, exist_ok=True)
+
+    jobs = []
+    members = []
+    for name in packlist:
+        zname = name.replace("-pygbag.", ".")
+        # the entry point is run from source, never imported
+        if not zname.endswith(".py") or zname == f"/{mainscript}":
+            continue
+        source = folder / name[1:]
+        arcname = Path("assets").joinpath(zname[1:])
+        key = hashlib.sha256(source.read_bytes())
+        # the archive name is the co_filename of tracebacks, same sources at other paths get their own pyc
+        key.update(f"\0{arcname.as_posix()}\0{pybuild}\0{optimize}\0{PYC_VERSION}".encode())
+        pyc = cache / f"{key.hexdigest()}.pyc"
+        if not pyc.is_file():
+            jobs.append((str(source), str(pyc), arcname.as_posix(), optimize))
+        members.append((pyc, arcname))
+
+    tag = f"cpython-{pybuild.replace('.', '')}"
+    if jobs:
+        proc = profiling.run([python, "-c", COMPILER], input=json.dumps(jobs), stdout=subprocess.PIPE, text=True)
+        tag = proc.stdout.strip() or tag
+
+    compiled = []
+    for pyc, arcname in members:
+        if pyc.is_file():
+            compiled.append((pyc, arcname.parent / "__pycache__" / f"{arcname.stem}.{tag}.pyc"))
+
+    print(f"    -> {len(compiled)} module(s) compiled for python {pybuild}, {len(jobs)} not cached{' with -OO' if optimize == 2 else ''}")
+    return compiled
@@ -0,0 +1,129 @@
+"""
+content encodings for the web : build/web files get .br and .gz siblings a
+server can send as is with a Content-Encoding header, and the test server
+compresses what it proxies or rewrites.
+
+brotli is optional, without it only gzip is used.
+"""
+
+import gzip
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+# (Accept-Encoding token, file suffix), preferred first
+ENCODINGS = [("gzip", ".gz")]
+if brotli:
+    ENCODINGS.insert(0, ("br", ".br"))
+
+# of the variants written, also by a process having brotli
+SUFFIXES = (".br", ".gz")
+
+# text and code, including the wasm binary and python stdlib data
+COMPRESSIBLE = "html htm js mjs css json map py txt md svg xml csv tmx tsx glsl wasm data".split()
+
+# smaller files fit in a packet anyway
+MINIMUM = 512
+
+# an encoding not saving that much is not worth the decoding
+THRESHOLD = 0.9
+
+GZIP_LEVEL = 9
+BROTLI_QUALITY = 9
+
+
+def compressible(path, size=MINIMUM):
+    return size >= MINIMUM and Path(path).suffix[1:].lower() in COMPRESSIBLE
+
+
+def encode(data, token):
+    if token == "br":
+        return brotli.compress(data, quality=BROTLI_QUALITY)
+    # no name nor time in the header, same bytes at each build
+    return gzip.compress(data, GZIP_LEVEL, mtime=0)
+
+
+def negotiate(accept):
+    """(token, suffix) of the preferred encoding an Accept-Encoding header allows, or None"""
+    weights = {}
+    for item in accept.split(","):
+        token, _, params = item.strip().partition(";")
+        weight = 1.0
+        for param in params.split(";"):
+            name, _, value = param.strip().partition("=")
+            if name == "q":
+                try:
+                    weight = float(value)
+                except ValueError:
+                    weight = 0.0
+        weights[token.strip().lower()] = weight
+
+    best = None
+    for token, suffix in ENCODINGS:
+        weight = weights.get(token, weights.get("*", 0.0))
+        if weight > 0 and (best is None or weight > best[0]):
+            best = (weight, (token, suffix))
+    return best and best[1]
+
+
+def variant(source, token, suffix):
+    """
+    encoded copy of source next to it, made when missing or when its mtime differs from
+    source one. None when the encoding does not pay.
+    """
+    source = Path(source)
+    target = source.with_name(source.name + suffix)
+    st = source.stat()
+    try:
+        known = target.stat()
+        if known.st_mtime_ns == st.st_mtime_ns:
+            return target if known.st_size else None
+    except OSError:
+        pass
+
+    encoded = encode(source.read_bytes(), token)
+    # an empty variant records that the encoding does not pay
+    if len(encoded) > st.st_size * THRESHOLD:
+        encoded = b""
+    tmp = target.with_name(f"{target.name}.{os.getpid()}.{time.monotonic_ns()}.tmp")
+    tmp.write_bytes(encoded)
+    os.utime(tmp, ns=(st.st_atime_ns, st.st_mtime_ns))
+    os.replace(tmp, target)
+    return target if encoded else None
+
+
+def siblings(build_dir, jobs=0):
+    """write encoded siblings of compressible files in build_dir, returns (files, bytes, encoded bytes)"""
+    sources = []
+    for path in sorted(Path(build_dir).rglob("*")):
+        if path.is_file() and compressible(path, path.stat().st_size):
+            sources.append(path)
+
+    def work(source):
+        size = source.stat().st_size
+        saved = []
+        for token, suffix in ENCODINGS:
+            target = variant(source, token, suffix)
+            if target:
+                saved.append(target.stat().st_size)
+            else:
+                # not worth it
+                source.with_name(source.name + suffix).unlink()
+        return size, min(saved, default=size), bool(saved)
+
+    # zlib and brotli release the GIL
+    with ThreadPoolExecutor(jobs or os.cpu_count()) as executor:
+        results = list(executor.map(work, sources))
+
+    files = sum(1 for size, best, encoded in results if encoded)
+    size = sum(size for size, best, encoded in results if encoded)
+    best = sum(best for size, best, encoded in results if encoded)
+    print(f"    -> {files} file(s) precompressed ({', '.join(token for token, suffix in ENCODINGS)}), {size} -> {best} bytes")
+    return files, size, best
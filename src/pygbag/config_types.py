@@ -8,5 +8,14 @@ class DEPENDENCIES(NamedTuple):
     ignoredirs:List[str]
     ignorefiles:List[str]
 
+class COMPRESSION(NamedTuple):
+    levels:List[str]
+    threshold:float
+
+class MODULES(NamedTuple):
+    keep:List[str]
+
 class Config(NamedTuple):
-    DEPENDENCIES:DEPENDENCIES
\ No newline at end of file
+    DEPENDENCIES:DEPENDENCIES
+    COMPRESSION:COMPRESSION
+    MODULES:MODULES
\ No newline at end of file
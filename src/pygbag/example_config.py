@@ -1,4 +1,11 @@
 EXAMPLE_CONFIG = """[DEPENDENCIES]
 ignoreDirs = ["ignoreThisFolder","ignoreThisFolder2","ignoreThisFolder3"]
 ignoreFiles = ["File1.ignorethis", "File2.ignorethis", "File3.ignorethis"]
+
+[COMPRESSION]
+levels = []
+threshold = 0.95
+
+[MODULES]
+keep = []
 """
\ No newline at end of file
@@ -1,3 +1,4 @@
+import re
 from pathlib import Path
 
 dbg = False
@@ -23,62 +24,141 @@ IGNORE = """
 /ignore
 /static
 /ATTIC
+node_modules/
+__pycache__/
 """.splitlines()
 
 SKIP_EXT = ["lnk", "pyc", "pyx", "pyd", "pyi", "exe", "bak", "log", "blend", "DS_Store"]
 
 
-def filter(walked, ignore_dirs, ignore_files):
-    global dbg, IGNORE, SKIP_EXT, IGNORE_FILES
-    IGNORE.extend(ignore_dirs)
+def translate(pattern):
+    # gitignore glob to regex, "*" does not cross "/" but "**" does
+    i, n = 0, len(pattern)
+    res = []
+    while i < n:
+        c = pattern[i]
+        if pattern.startswith("**/", i):
+            res.append("(?:.*/)?")
+            i += 3
+            continue
+        if pattern.startswith("**", i):
+            res.append(".*")
+            i += 2
+            continue
+        if c == "*":
+            res.append("[^/]*")
+        elif c == "?":
+            res.append("[^/]")
+        elif c == "[":
+            j = pattern.find("]", i + 1)
+            if j < 0:
+                res.append(re.escape(c))
+            else:
+                chars = pattern[i + 1 : j].replace("\\", "\\\\")
+                if chars.startswith("!"):
+                    chars = "^" + chars[1:]
+                res.append(f"[{chars}]")
+                i = j
+        else:
+            res.append(re.escape(c))
+        i += 1
+    return "".join(res)
+
+
+class Matcher:
+    """
+    IGNORE, pygbag.ini ignoreDirs/ignoreFiles and the app .gitignore compiled
+    to a few regexes over posix paths relative to app folder ( "/img/a.png" ).
+    """
+
+    def __init__(self, root=None, ignore_dirs=(), ignore_files=()):
+        # [ignore, keep] pattern lists for directories and files
+        self.dirs = [[], []]
+        self.files = [[], []]
+
+        for line in IGNORE:
+            self.add(line)
+
+        for line in ignore_dirs:
+            line = line.strip()
+            if line:
+                self.add(line.rstrip("/") + "/")
+
+        for line in ignore_files:
+            self.add(line)
+
+        if root is not None:
+            gitignore = Path(root) / ".gitignore"
+            if gitignore.is_file():
+                for line in gitignore.read_text(encoding="utf-8", errors="replace").splitlines():
+                    self.add(line)
+
+        self.skip_ext = set(ext.lower() for ext in SKIP_EXT)
+
+        def compile(patterns):
+            if patterns:
+                return re.compile("|".join(f"(?:{p})" for p in patterns)).search
+            return lambda path: None
+
+        self.dir_ignore, self.dir_keep = map(compile, self.dirs)
+        self.file_ignore, self.file_keep = map(compile, self.files)
+
+    def add(self, line):
+        line = line.rstrip()
+        if not line or line.startswith("#"):
+            return
+
+        keep = line.startswith("!")
+        if keep:
+            line = line[1:]
+
+        dir_only = line.endswith("/")
+        line = line.strip("/") if dir_only else line
+
+        # a slash anywhere but at the end anchors the pattern to app folder
+        if line.startswith("/") or line.find("/") > 0:
+            regex = "^/" + translate(line.lstrip("/")) + "$"
+        else:
+            regex = "(?:^|/)" + translate(line) + "$"
+
+        self.dirs[keep].append(regex)
+        if not dir_only:
+            self.files[keep].append(regex)
+
+    def skip_dir(self, rel):
+        name = rel.rsplit("/", 1)[-1]
+        # ignore .* folders
+        if name.startswith("."):
+            return True
+        return bool(self.dir_ignore(rel)) and not self.dir_keep(rel)
 
-    IGNORE_FILES = ignore_files
+    def skip_file(self, rel):
+        name = rel.rsplit("/", 1)[-1]
+        # ignore .* files, including .gitignore
+        if name.startswith("."):
+            return True
+        if name.rsplit(".", 1)[-1].lower() in self.skip_ext:
+            return True
+        return bool(self.file_ignore(rel)) and not self.file_keep(rel)
 
-    for folder, filenames in walked:
-        blocking = False
 
-        fx = Path(folder).as_posix()
+def filter(walked, ignore_dirs, ignore_files, matcher=None):
+    global dbg
 
-        # ignore .* folders
-        if fx.startswith("."):
-            continue
-
-        for block in IGNORE:
-            if not block:
-                continue
-
-            if folder.match(block):
-                if dbg:
-                    print("REJ 1", folder)
-                blocking = True
-                break
+    matcher = matcher or Matcher(None, ignore_dirs, ignore_files)
 
-            if fx.startswith(f"{block}/"):
-                if dbg:
-                    print("REJ 2", folder)
-                blocking = True
-                break
+    for folder, filenames in walked:
+        fx = Path(folder).as_posix()
 
-        if blocking:
+        parts = fx.strip("/").split("/") if fx != "/" else []
+        if any(matcher.skip_dir("/" + "/".join(parts[: i + 1])) for i in range(len(parts))):
+            if dbg:
+                print("REJ 1", folder)
             continue
 
         for filename in filenames:
-            fnx = Path(filename).as_posix()
-
-            # ignore .* files
-            if fnx.startswith("."):
-                continue
-
-            if fnx in [".gitignore"]:
-                if dbg:
-                    print("REJ 3", folder, filename)
-                continue
-
-            if fnx in IGNORE_FILES:
-                continue
-
-            ext = fnx.rsplit(".", 1)[-1].lower()
-            if ext in SKIP_EXT:
+            fnx = Path(folder).joinpath(filename).as_posix()
+            if matcher.skip_file(fnx):
                 if dbg:
                     print("REJ 4", folder, filename)
                 continue
@@ -6,13 +6,57 @@ class Error(Exception):
     pass
 
 
-def gather(root: Path, *kw):
+def check(root: Path):
     if root.is_file():
         if root.name == "main.py":
             raise Error("project must be a folder or an archive")
 
+
+def gather(root: Path, *kw):
+    check(root)
+
     for current, dirnames, filenames in os.walk(root):
         rel = Path("/").joinpath(Path(current).relative_to(root))
 
         # print(rel, len(dirnames), len(filenames))
         yield rel, filenames
+
+
+def walk(root: Path, matcher):
+    """
+    os.scandir based gather+filter : ignored folders are pruned before being
+    entered, yields (folder, file) relative to root like filtering.filter.
+    """
+    check(root)
+
+    stack = ["/"]
+    while stack:
+        rel = stack.pop()
+        dirnames = []
+        filenames = []
+        try:
+            with os.scandir(root.joinpath(rel[1:])) as entries:
+                for entry in entries:
+                    if entry.is_dir():
+                        # like os.walk, do not follow symlinked folders
+                        if not entry.is_symlink():
+                            dirnames.append(entry.name)
+                    else:
+                        filenames.append(entry.name)
+        except OSError as e:
+            print(f"cannot scan {root}{rel} : {e}")
+            continue
+
+        # someone's virtual env, whatever its name
+        if rel != "/" and "pyvenv.cfg" in filenames:
+            continue
+
+        folder = Path(rel)
+        prefix = rel.rstrip("/")
+        for filename in sorted(filenames):
+            if not matcher.skip_file(f"{prefix}/{filename}"):
+                yield folder, folder.joinpath(filename)
+
+        for dirname in sorted(dirnames, reverse=True):
+            if not matcher.skip_dir(f"{prefix}/{dirname}"):
+                stack.append(f"{prefix}/{dirname}")
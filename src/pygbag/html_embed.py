@@ -1,58 +1,116 @@
+import binascii
 from pathlib import Path
 
 import pygbag
 
+# 57 bytes make the usual 76 chars base64 lines, encoded by chunks of many lines
+LINE = 57
+CHUNK = LINE * 1024
+
 
 def stringify(blob):
-    c = 0
-    for b in blob:
-        yield chr(int(b) + 248)
-        c += 1
-        if c > 78:
-            yield "\n"
-            c = 0
+    """
+    base64 text of a binary file object, by chunks of 76 chars lines.
+    base85 would be smaller but its alphabet can form "<!--" or "-->" which html
+    parsers do not ignore inside a script, and binascii has no decoder for it.
+    """
+    while True:
+        data = blob.read(CHUNK)
+        if not data:
+            break
+        yield b"".join(binascii.b2a_base64(data[pos : pos + LINE]) for pos in range(0, len(data), LINE)).decode("ascii")
+
+
+# runtime side of dump_fs : files are only registered, and decoded to disk on
+# first open() or import, so a page does not pay for assets it never uses.
+FS_LAZY = """
+def fs_lazy():
+    import builtins, importlib, os, sys
+    from binascii import a2b_base64
+    import aio.fetch
+
+    index = {}
+    builtin_open = builtins.open
+
+    def key(path):
+        try:
+            return os.path.abspath(os.fspath(path))
+        except TypeError:
+            return None
+
+    def fetch(path):
+        entry = index.pop(key(path), None) if index else None
+        if entry is not None:
+            data, text = entry
+            if text:
+                with builtin_open(path, "w", encoding="utf-8") as fs:
+                    fs.write(data)
+            else:
+                with builtin_open(path, "wb") as fs:
+                    fs.write(a2b_base64(data))
+        return entry is not None
+
+    def fetch_folder(path):
+        # files of a folder are made before it is listed
+        folder = key(path)
+        if index and isinstance(folder, str):
+            for filename in [filename for filename in index if os.path.dirname(filename) == folder]:
+                fetch(filename)
+
+    class Finder:
+        @staticmethod
+        def find_spec(fullname, path=None, target=None):
+            found = False
+            tail = fullname.rpartition(".")[2]
+            for base in path or sys.path:
+                for candidate in (os.path.join(base, f"{tail}.py"), os.path.join(base, tail, "__init__.py")):
+                    found = fetch(candidate) or found
+            if found:
+                importlib.invalidate_caches()
+            return None
+
+    sys.meta_path.insert(0, Finder)
+    # open, stat, listings and pygame loaders, as for content bundles
+    aio.fetch.fs_hook(fetch, fetch_folder)
+
+    def register(fsname, data, text=False):
+        filename = os.path.abspath(fsname)
+        if not os.path.isfile(filename):
+            os.makedirs(os.path.dirname(filename), exist_ok=True)
+            index[filename] = (data, text)
+
+    return register
+"""
+
+
+def embed_text(text):
+    # for a triple quoted literal in a script element
+    return text.replace("\\", "\\\\").replace('"', '\\"').replace("</", "\\x3c/")
 
 
 def dump_fs(html, target_folder, packlist):
-    html.write(
-        f"""PYGBAG_FS={len(packlist)}
-# fmt: off
-__import__('os').chdir(__import__('tempfile').gettempdir())
-def fs_decode(fsname, o248):
-    from pathlib import Path
-    filename = Path.cwd() / fsname
-    if not filename.is_file():
-        filename.parent.mkdir(parents=True, exist_ok=True)
-        with open(fsname,"wb") as fs:
-            for input in o248.split("\\n"):
-                if not input: continue
-                fs.write(bytes([ord(c) - 248 for c in input]))
-"""
-    )
+    html.write(f"PYGBAG_FS={len(packlist)}\n# fmt: off\n__import__('os').chdir(__import__('tempfile').gettempdir())\n")
+    html.write(FS_LAZY)
+    html.write("fs_decode = fs_lazy()\ndel fs_lazy\n")
 
     for topack in packlist:
-        if topack == "/main.py":
-            continue
-
         vfs_name = topack[1:].replace("-pygbag.", ".")
 
-        src_name = target_folder / topack[1:]
+        # the running script itself
+        if vfs_name == "main.py":
+            continue
 
-        sum = str(src_name.stat().st_size)
+        src_name = target_folder / topack[1:]
 
         if topack.lower().endswith(".py"):
-            html.write(
-                f'''
-with open("{vfs_name}","w") as fs:fs.write("""\\
-{open(src_name, "r").read()}""")
-'''
-            )
-            html.write("\n")
+            with open(src_name, "r", encoding="utf-8") as file:
+                html.write(f'\nfs_decode("{vfs_name}","""\\\n{embed_text(file.read())}""", True)\n')
 
         else:
             html.write(f"\nfs_decode('{vfs_name}','''\n")
-            for text in stringify(open(src_name, "rb").read()):
-                html.write(text)
+            with open(src_name, "rb") as blob:
+                for text in stringify(blob):
+                    html.write(text)
             html.write("''')\n")
 
     html.write("\n# fmt:on\ndel fs_decode, PYGBAG_FS\n")
@@ -97,7 +155,7 @@ def html_embed(target_folder, packlist: list, htmlfile: str):
 
     topack = "/main.py"
 
-    with open(htmlfile, "w+", encoding="utf-8") as html:
+    with open(htmlfile, "w+", encoding="utf-8", buffering=CHUNK * 4) as html:
 
         def main_py():
             with open(target_folder / topack[1:], "r", encoding="utf-8") as file:
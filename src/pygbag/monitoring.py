@@ -0,0 +1,123 @@
+"""
+test server metrics : served at /__pygbag/metrics in prometheus text format,
+and summed up as json when the server stops.
+"""
+
+import json
+import threading
+
+PATH = "/__pygbag/metrics"
+
+# the page reports its time to first frame there, ?seconds=
+FIRST_FRAME = "/__pygbag/first_frame"
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+class Histogram:
+    def __init__(self, name, help, buckets):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(buckets)
+        self.counts = [0] * len(self.buckets)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+        self.lock = threading.Lock()
+
+    def observe(self, value):
+        with self.lock:
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    self.counts[i] += 1
+                    break
+            self.count += 1
+            self.sum += value
+            self.max = max(self.max, value)
+
+    def quantile(self, q):
+        """upper bound of the bucket holding the q quantile"""
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return self.max
+
+    def text(self):
+        with self.lock:
+            lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+            seen = 0
+            for bound, count in zip(self.buckets, self.counts):
+                seen += count
+                lines.append(f'{self.name}_bucket{{le="{bound}"}} {seen}')
+            lines.append(f'{self.name}_bucket{{le="+Inf"}} {self.count}')
+            lines.append(f"{self.name}_sum {self.sum}")
+            lines.append(f"{self.name}_count {self.count}")
+        return lines
+
+    def summary(self):
+        with self.lock:
+            return {
+                "count": self.count,
+                "sum": round(self.sum, 6),
+                "mean": round(self.sum / self.count, 6) if self.count else 0,
+                "p50": self.quantile(0.5) if self.count else 0,
+                "p95": self.quantile(0.95) if self.count else 0,
+                "max": round(self.max, 6),
+            }
+
+
+class Counter:
+    def __init__(self, name, help, label):
+        self.name = name
+        self.help = help
+        self.label = label
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def inc(self, value, amount=1):
+        with self.lock:
+            self.values[value] = self.values.get(value, 0) + amount
+
+    def text(self):
+        with self.lock:
+            lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+            for value, count in sorted(self.values.items()):
+                lines.append(f'{self.name}{{{self.label}="{value}"}} {count}')
+        return lines
+
+    def summary(self):
+        with self.lock:
+            return dict(self.values)
+
+
+SECONDS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+BYTES = (256, 1 << 10, 4 << 10, 16 << 10, 64 << 10, 256 << 10, 1 << 20, 4 << 20, 16 << 20, 64 << 20, 256 << 20)
+
+
+class METRICS:
+    REQUEST = Histogram("pygbag_request_duration_seconds", "time from request read to response sent", SECONDS)
+    SENT = Histogram("pygbag_response_bytes", "body bytes sent per response", BYTES)
+    STATUS = Counter("pygbag_responses_total", "responses by status code", "code")
+    CDN = Counter("pygbag_cdn_requests_total", "CDN proxy requests by cache result", "result")
+    UPSTREAM = Histogram("pygbag_upstream_fetch_seconds", "CDN file download time, cache misses only", SECONDS)
+    REBUILD = Histogram("pygbag_rebuild_seconds", "apk repack time on request", SECONDS)
+    FIRST_FRAME = Histogram("pygbag_first_frame_seconds", "time from navigation start to first display flip, as reported by the page", SECONDS)
+
+
+def all_metrics():
+    return [value for name, value in vars(METRICS).items() if isinstance(value, (Histogram, Counter))]
+
+
+def text():
+    """prometheus text exposition of all metrics"""
+    lines = []
+    for metric in all_metrics():
+        lines.extend(metric.text())
+    return ("\n".join(lines) + "\n").encode("utf-8")
+
+
+def summary():
+    return json.dumps({metric.name: metric.summary() for metric in all_metrics()}, indent=1)
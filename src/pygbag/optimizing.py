@@ -2,6 +2,18 @@ import os
 import sys
 from pathlib import Path
 import warnings
+import collections
+import concurrent.futures
+import hashlib
+import io
+import json
+import re
+import shutil
+import subprocess
+import threading
+import tokenize
+
+from . import profiling
 
 
 """
@@ -34,6 +46,179 @@ BAD = {
     "xm": "ogg",
 }
 
+# source suffixes that may have produced a given -pygbag sibling
+SOURCES = {
+    ".png": [".png"],
+    ".ogg": [".mp3", ".wav", ".ogg", ".flac"],
+}
+
+
+# bump when rewrite_refs output changes, it is part of the cache key
+REFS_VERSION = "3"
+
+# lowercase only, as optimize() converts by exact suffix
+REFS = re.compile(r"\.(%s)$" % "|".join(map(re.escape, BAD)))
+
+
+def asset_refs(data):
+    """
+    positions of BAD extensions ending a string literal, in one tokenizer pass.
+    covers any quoting, f-strings and constants given to os.path.join() alike.
+    yields (row, start col, end col, bad extension)
+    """
+    tokens = list(tokenize.tokenize(io.BytesIO(data).readline))
+    for idx, tok in enumerate(tokens):
+        if tok.type == tokenize.STRING:
+            text = tok.string
+            quote = text[-3:] if text[-3:] in ('"""', "'''") and len(text) >= 6 else text[-1]
+            body = text[: -len(quote)]
+        elif tok.type == getattr(tokenize, "FSTRING_MIDDLE", None) and tokens[idx + 1].type == tokenize.FSTRING_END:
+            # 3.12+ : f"{name}.wav" is split, literal tail comes before FSTRING_END
+            quote = ""
+            body = tok.string
+        else:
+            continue
+
+        found = REFS.search(body)
+        if found:
+            row, col = tok.end
+            end = col - len(quote)
+            yield row, end - len(found.group(0)), end, found.group(1)
+
+
+def rewrite_refs(data):
+    """rewrite asset references to their optimized format, returns new source and [bad, good] fixes"""
+    edits = list(asset_refs(data))
+    if not edits:
+        return data, []
+
+    encoding, _ = tokenize.detect_encoding(io.BytesIO(data).readline)
+    # rows as tokenize counts them, str.splitlines also breaks on \x0c, \x1c-\x1e, \x85, \u2028 ...
+    lines = io.StringIO(data.decode(encoding), newline="\n").readlines()
+    fixes = []
+    for row, start, end, bad in reversed(edits):
+        good = BAD[bad]
+        line = lines[row - 1]
+        lines[row - 1] = f"{line[:start]}.{good}{line[end:]}"
+        if [bad, good] not in fixes:
+            fixes.insert(0, [bad, good])
+    return "".join(lines).encode(encoding), fixes
+
+
+def file_hash(filename):
+    h = hashlib.sha256()
+    with open(filename, "rb") as file:
+        while True:
+            chunk = file.read(1 << 20)
+            if not chunk:
+                break
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def tool_version(*cmd):
+    try:
+        proc = profiling.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+    except OSError:
+        return ""
+    for line in proc.stdout.splitlines():
+        if line.strip():
+            return line.strip()
+    return ""
+
+
+class OptCache:
+    """
+    content addressed store of optimizer outputs in build/web-cache/opt
+
+    blobs are keyed on (source hash, tool, tool version, parameters), the index
+    remembers which -pygbag siblings were generated so they are never mistaken
+    for user provided files.
+    """
+
+    INDEX = "generated.json"
+
+    def __init__(self, cache_dir):
+        self.root = Path(cache_dir) / "opt"
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.index_file = self.root / self.INDEX
+        self.generated = {}
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        if self.index_file.is_file():
+            try:
+                self.generated = json.loads(self.index_file.read_text())
+            except ValueError:
+                warnings.warn(f"corrupted optimizer index {self.index_file}, ignoring")
+
+    @staticmethod
+    def key(source_hash, tool, version, params):
+        return hashlib.sha256("\0".join((source_hash, tool, version, params)).encode()).hexdigest()
+
+    def blob(self, key, suffix):
+        return self.root / key[:2] / f"{key}{suffix}"
+
+    def count(self, found):
+        with self.lock:
+            if found:
+                self.hits += 1
+            else:
+                self.misses += 1
+        return found
+
+    def fetch(self, key, dest):
+        blob = self.blob(key, dest.suffix)
+        found = blob.is_file()
+        if found:
+            shutil.copyfile(blob, dest)
+        return self.count(found)
+
+    def store(self, key, produced):
+        self.write(self.blob(key, produced.suffix), produced.read_bytes())
+
+    def write(self, blob, data):
+        blob.parent.mkdir(exist_ok=True)
+        tmp = blob.with_name(f"{blob.name}.{os.getpid()}-{threading.get_ident()}.tmp")
+        tmp.write_bytes(data)
+        os.replace(tmp, blob)
+
+    def meta(self, key, value=None):
+        # small json record stored along a key, eg analysis results
+        blob = self.blob(key, ".json")
+        if value is not None:
+            self.write(blob, json.dumps(value).encode())
+            return value
+        if blob.is_file():
+            try:
+                return json.loads(blob.read_text())
+            except ValueError:
+                pass
+        return None
+
+    def is_generated(self, relpath):
+        return str(relpath) in self.generated
+
+    def mark(self, relpath, source, key):
+        with self.lock:
+            self.generated[str(relpath)] = [str(source), key]
+
+    def save(self):
+        tmp = self.index_file.with_suffix(".tmp")
+        tmp.write_text(json.dumps(self.generated, indent=1, sort_keys=True))
+        os.replace(tmp, self.index_file)
+
+
+def is_opt_sibling(folder, fp, cache):
+    """a -pygbag file which is either generated by us or has a source to be regenerated from"""
+    if cache.is_generated(fp.as_posix()):
+        return True
+    stem = fp.stem[: -len("-pygbag")]
+    for suffix in SOURCES.get(fp.suffix, []):
+        if Path(f"{folder}/{fp.parent}/{stem}{suffix}").is_file():
+            return True
+    return False
+
 
 if sys.platform != "linux":
 
@@ -57,19 +242,24 @@ else:
             import black
 
             print("Applying black format")
-            os.popen(f'black -t py311 -l 132 "{folder}"').read()
+            profiling.popen(f'black -t py311 -l 132 "{folder}"')
         except ImportError:
             warnings.warn(f"Black not found for processing {folder=}")
 
         if "--no_opt" in sys.argv:
             pass
         else:
-            if os.popen("pngquant 2>&1").read().count("pngfile"):
+            if profiling.popen("pngquant 2>&1").count("pngfile"):
                 print(f"    -> with pngquant --quality {png_quality}", folder)
             else:
                 png_quality = -1
 
-        has_ffmpeg = os.popen("ffmpeg -version").read().count("version")
+        has_ffmpeg = profiling.popen("ffmpeg -version").count("version")
+
+        cache = OptCache(kw.get("cache_dir") or Path(folder) / "build" / "web-cache")
+
+        pngquant_version = tool_version("pngquant", "--version") if png_quality >= 0 else ""
+        ffmpeg_version = tool_version("ffmpeg", "-version") if has_ffmpeg else ""
 
         truncate = len(str(folder))
 
@@ -101,85 +291,121 @@ else:
                     yield fp.as_posix()
             return
 
-        for fp in filenames:
+        def cached_encode(fp, opt, tool, version, params, cmd):
+            # get opt from the cache or run cmd producing it, cmd has a {} placeholder for output
             fname = f"{folder}{fp}"
-            if fp.suffix == ".py":
-                tofix = []
-                for bad in BAD.keys():
-                    with open(fname, "r") as source:
-                        for l in source.readlines():
-                            if l.find(f'.{bad}"') > 0:
-                                tofix.append([bad, BAD[bad]])
-                                break
-
-                if len(tofix):
-                    fixname = Path(f"{fp.parent}/{fp.stem}-pygbag.py")
-                    opt = Path(f"{folder}/{fixname}")
-                    with open(fname, "r", encoding="utf-8") as source:
-                        data = open(fname, "r").read()
-                        with open(opt, "w", encoding="utf-8") as dest:
-                            while len(tofix):
-                                bad, good = tofix.pop(0)
-                                warnings.warn(f"potential {bad.upper()} use in {fname}, prefer .{good} !")
-                                data = data.replace(f'.{bad}"', f'.{good}"')
-                            dest.write(data)
+            key = cache.key(file_hash(fname), tool, version, " ".join(params))
+            if not cache.fetch(key, opt):
+                produced = cache.root / f"{key}.{os.getpid()}-{threading.get_ident()}{opt.suffix}"
+                cmd = [str(produced) if arg == "{}" else arg for arg in cmd]
+                profiling.run(cmd, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+                if not produced.is_file():
+                    print("ERROR", " ".join(cmd), "for", opt)
+                    return False
+                cache.store(key, produced)
+                os.replace(produced, opt)
+            cache.mark(translated(opt), fp.as_posix(), key)
+            profiling.source(opt, fname)
+            return True
+
+        def fix_python(fp, opt):
+            # each source is read and tokenized once, results are cached by source hash
+            fname = f"{folder}{fp}"
+            with open(fname, "rb") as source:
+                data = source.read()
+            key = cache.key(hashlib.sha256(data).hexdigest(), "refs", REFS_VERSION, json.dumps(BAD, sort_keys=True))
+
+            meta = cache.meta(key)
+            if meta is None or (meta["fixes"] and not cache.blob(key, ".py").is_file()):
+                cache.count(False)
+                try:
+                    fixed, fixes = rewrite_refs(data)
+                except (tokenize.TokenError, SyntaxError) as e:
+                    warnings.warn(f"cannot scan {fname} for assets references : {e}")
+                    fixed, fixes = data, []
+                if fixes:
+                    cache.write(cache.blob(key, ".py"), fixed)
+                meta = cache.meta(key, {"fixes": fixes})
+            else:
+                cache.count(True)
 
-                    yield translated(opt)
-                    continue
+            if not meta["fixes"]:
+                return False
 
-            if fp.suffix == ".png":
-                if png_quality >= 0:
-                    if fp.stem.endswith("-pygbag"):
-                        pass  # yield that file
-                    else:
-                        # .with_stem() 3.9+
-                        opt = Path(f"{folder}/{fp.parent}/{fp.stem}-pygbag.png")
-
-                        if opt.is_file():
-                            # this is the no opt source, skip it
-                            print("opt-skip(38)", fp)
-                            continue
-
-                        osexec = f'pngquant -f --ext -pygbag.png --quality {png_quality} "{fname}"'
-                        os.system(osexec)
-                        if opt.is_file():
-                            yield translated(opt)
-                            continue
-                        else:
-                            print("ERROR", osexec, "for", opt)
-
-            elif fp.suffix in [".mp3", ".wav", ".ogg", ".flac"]:
-                if fp.stem.endswith("-pygbag"):
-                    pass  # yield that file
-                else:
-                    opt = Path(f"{folder}/{fp.parent}/{fp.stem}-pygbag.ogg")
-                    if opt.is_file():
-                        # this is the no opt source, skip it
-                        print("opt-skip(73)", fp)
-                        continue
+            for bad, good in meta["fixes"]:
+                warnings.warn(f"potential {bad.upper()} use in {fname}, prefer .{good} !")
 
-                    osexec = f'ffmpeg -i "{fname}" -ac 1 -r 22000 "{opt}"'
+            shutil.copyfile(cache.blob(key, ".py"), opt)
+            cache.mark(translated(opt), fp.as_posix(), key)
+            profiling.source(opt, fname)
+            return True
 
-                    if has_ffmpeg:
-                        os.system(osexec)
+        # external encoders run concurrently, but results are handed out in input order
+        pending = collections.deque()
 
-                    if opt.is_file():
-                        yield translated(opt)
-                        continue
-                    else:
-                        if has_ffmpeg:
-                            print("ERROR", osexec, "for", opt)
+        def resolve(block):
+            while pending:
+                fp, opt, job = pending[0]
+                if job is not None and not (block or job.done()):
+                    break
+                pending.popleft()
 
-                        if fp.suffix == ".mp3":
-                            print(
-                                f"""
+                if job is not None and job.result():
+                    yield translated(opt)
+                    continue
+
+                if fp.suffix == ".mp3" and not fp.stem.endswith("-pygbag"):
+                    print(
+                        f"""
 
        ERROR: MP3 audio format is not allowed on web, convert {fp} to ogg
 
 """
-                            )
-                            sys.exit(3)
+                    )
+                    sys.exit(3)
+
+                if fp not in done_list:
+                    done_list.append(fp)
+                    yield fp.as_posix()
+
+        jobs = kw.get("jobs") or os.cpu_count() or 1
+        if jobs > 1:
+            print(f"    -> running {jobs} optimizer jobs")
+
+        try:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as pool:
+                for fp in filenames:
+                    fname = f"{folder}{fp}"
+                    opt = job = None
+
+                    # never reuse a -pygbag sibling that was, or can be, regenerated from a source
+                    if fp.stem.endswith("-pygbag") and is_opt_sibling(folder, fp, cache):
+                        continue
 
-            if fp not in done_list:
-                done_list.append(fp)
-                yield fp.as_posix()
+                    if fp.suffix == ".py":
+                        opt = Path(f"{folder}/{fp.parent}/{fp.stem}-pygbag.py")
+                        job = pool.submit(fix_python, fp, opt)
+
+                    elif fp.suffix == ".png":
+                        if png_quality >= 0 and not fp.stem.endswith("-pygbag"):
+                            # .with_stem() 3.9+
+                            opt = Path(f"{folder}/{fp.parent}/{fp.stem}-pygbag.png")
+                            params = ["--quality", str(png_quality)]
+                            cmd = ["pngquant", "-f", *params, "--output", "{}", fname]
+                            job = pool.submit(cached_encode, fp, opt, "pngquant", pngquant_version, params, cmd)
+
+                    elif fp.suffix in [".mp3", ".wav", ".ogg", ".flac"]:
+                        if has_ffmpeg and not fp.stem.endswith("-pygbag"):
+                            opt = Path(f"{folder}/{fp.parent}/{fp.stem}-pygbag.ogg")
+                            params = ["-ac", "1", "-r", "22000"]
+                            cmd = ["ffmpeg", "-y", "-i", fname, *params, "{}"]
+                            job = pool.submit(cached_encode, fp, opt, "ffmpeg", ffmpeg_version, params, cmd)
+
+                    pending.append((fp, opt, job))
+                    yield from resolve(block=False)
+
+                yield from resolve(block=True)
+        finally:
+            cache.save()
+            if cache.hits or cache.misses:
+                print(f"    -> optimizer cache : {cache.hits} hit(s) {cache.misses} miss(es)")
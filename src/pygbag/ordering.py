@@ -0,0 +1,247 @@
+"""
+static assets dependency graph of an app.
+
+main.py and the modules it imports are parsed, string constants naming a
+packed file or folder are assets references. Members are then ordered by
+first reachability from the entry point, in source order, so a streaming
+loader can start the game before the tail of the archive has arrived.
+"""
+
+import ast
+import fnmatch
+import json
+import posixpath
+import warnings
+from pathlib import Path
+
+
+def logical(name):
+    # name of a packed file once in the apk
+    return name.replace("-pygbag.", ".")
+
+
+def norm(path):
+    path = posixpath.normpath(path)
+    if not path.startswith("/"):
+        return None
+    # normpath keeps a leading double slash
+    return "/" + path.lstrip("/")
+
+
+def scan(filename):
+    """imports and string constants of a module, in source order"""
+    with open(filename, "rb") as file:
+        tree = ast.parse(file.read(), str(filename))
+
+    refs = []
+    for node in ast.walk(tree):
+        pos = (getattr(node, "lineno", 0), getattr(node, "col_offset", 0))
+        if isinstance(node, ast.Import):
+            for alias in node.names:
+                refs.append((pos, "import", (alias.name, 0, [])))
+        elif isinstance(node, ast.ImportFrom):
+            refs.append((pos, "import", (node.module or "", node.level, [alias.name for alias in node.names])))
+        elif isinstance(node, ast.Constant) and isinstance(node.value, str):
+            refs.append((pos, "path", node.value))
+        elif isinstance(node, ast.Call) and isinstance(node.func, ast.Attribute) and node.func.attr == "join":
+            # os.path.join("img", "hero.png")
+            if node.args and all(isinstance(arg, ast.Constant) and isinstance(arg.value, str) for arg in node.args):
+                refs.append((pos, "path", "/".join(arg.value for arg in node.args)))
+
+        if isinstance(node, ast.Call):
+            # __import__(name), importlib.import_module(name) with a computed name
+            func = node.func.attr if isinstance(node.func, ast.Attribute) else getattr(node.func, "id", "")
+            if func in ("__import__", "import_module") and node.args and not isinstance(node.args[0], ast.Constant):
+                refs.append((pos, "dynamic", func))
+
+    refs.sort(key=lambda ref: ref[0])
+    return refs
+
+
+def exported(filename):
+    """names of a module __all__ list, when made of constants"""
+    with open(filename, "rb") as file:
+        tree = ast.parse(file.read(), str(filename))
+    for node in tree.body:
+        if isinstance(node, ast.Assign) and any(isinstance(target, ast.Name) and target.id == "__all__" for target in node.targets):
+            if isinstance(node.value, (ast.List, ast.Tuple)):
+                return [elt.value for elt in node.value.elts if isinstance(elt, ast.Constant) and isinstance(elt.value, str)]
+    return []
+
+
+def walk(folder, packlist, roots):
+    """
+    members reachable from the roots modules, in order of first reachability,
+    returns (ordered packlist names, {logical name: reach info}, {module: line of a computed import})
+    """
+    folder = Path(folder)
+    entries = {logical(name): name for name in packlist}
+
+    # every folder holding packed files, for references to a whole folder
+    folders = {}
+    for name in sorted(entries):
+        parent = posixpath.dirname(name)
+        while parent != "/":
+            folders.setdefault(parent, []).append(name)
+            parent = posixpath.dirname(parent)
+
+    ordered = []
+    reached = {}
+    scanned = set()
+    # module -> line of its first import with a computed name
+    dynamic = {}
+
+    def reach(name, source, depth):
+        if name in reached:
+            return False
+        reached[name] = {"name": name, "from": source, "depth": depth}
+        ordered.append(entries[name])
+        return True
+
+    def resolve_module(module, level, current):
+        base = ""
+        if level:
+            base = posixpath.dirname(current)
+            for _ in range(level - 1):
+                base = posixpath.dirname(base)
+        path = posixpath.join(base or "/", *module.split(".")) if module else base or "/"
+        found = []
+        # parent packages are imported first
+        parts = path.strip("/").split("/")
+        for idx in range(1, len(parts) + 1):
+            pkg = "/" + "/".join(parts[:idx])
+            for candidate in (f"{pkg}/__init__.py", f"{pkg}.py") if idx == len(parts) else (f"{pkg}/__init__.py",):
+                if candidate in entries:
+                    found.append(candidate)
+        return found
+
+    def resolve_path(value, current):
+        value = value.strip().replace("\\", "/")
+        if not value or value in (".", "/") or value.find("\n") >= 0 or value.find("://") > 0:
+            return []
+        for base in ("/", posixpath.dirname(current)):
+            candidate = norm(posixpath.join(base, value.lstrip("/") if base == "/" else value))
+            if candidate is None:
+                continue
+            if candidate in entries:
+                return [candidate]
+            if candidate in folders:
+                return folders[candidate]
+        return []
+
+    def visit_module(module, depth):
+        if module in scanned:
+            return
+        scanned.add(module)
+        try:
+            refs = scan(folder / entries[module][1:])
+        except (SyntaxError, ValueError, OSError) as e:
+            warnings.warn(f"cannot scan {module} for dependencies : {e}")
+            return
+        for pos, kind, value in refs:
+            if kind == "dynamic":
+                dynamic.setdefault(module, pos[0])
+            elif kind == "import":
+                name, level, names = value
+                targets = resolve_module(name, level, module)
+                if "*" in names:
+                    # from pkg import * loads the submodules listed in pkg __all__
+                    package = [target for target in targets if target.endswith("/__init__.py")]
+                    if package:
+                        try:
+                            names = names + exported(folder / entries[package[-1]][1:])
+                        except (SyntaxError, ValueError, OSError):
+                            pass
+                for sub in names:
+                    targets.extend(resolve_module(f"{name}.{sub}" if name else sub, level, module))
+                for target in targets:
+                    reach(target, module, depth + 1)
+                    visit_module(target, depth + 1)
+            else:
+                targets = resolve_path(value, module)
+                # import_module("levels.one") and alike
+                if not targets and value.replace(".", "").replace("_", "").isalnum():
+                    targets = resolve_module(value.lstrip("."), len(value) - len(value.lstrip(".")), module)
+                for target in targets:
+                    reach(target, module, depth + 1)
+                    # scripts run by path
+                    if target.endswith(".py"):
+                        visit_module(target, depth + 1)
+
+    for root in roots:
+        reach(root, None, 0)
+        visit_module(root, 0)
+
+    return ordered, reached, dynamic
+
+
+def order(folder, packlist, mainscript="main.py"):
+    """
+    reorder packlist by first reachability from mainscript,
+    returns (packlist, manifest) with unreached members kept in their order at the end.
+    """
+    entry = f"/{mainscript}"
+    if entry in set(logical(name) for name in packlist):
+        ordered, reached, dynamic = walk(folder, packlist, [entry])
+    else:
+        warnings.warn(f"entry point {entry} not packed, keeping files order")
+        ordered, reached, dynamic = [], {}, {}
+
+    unreached = [name for name in packlist if logical(name) not in reached]
+
+    manifest = {
+        "entry": mainscript,
+        "order": [reached[logical(name)] for name in ordered],
+        "unreached": [logical(name) for name in unreached],
+        "dynamic": dynamic,
+    }
+    return ordered + unreached, manifest
+
+
+def module_name(name):
+    # "/pkg/mod.py" -> "pkg.mod", "/pkg/__init__.py" -> "pkg"
+    parts = name[1:-3].split("/")
+    if parts[-1] == "__init__":
+        parts.pop()
+    return ".".join(parts)
+
+
+def prune(folder, packlist, manifest, keep=()):
+    """
+    drop python modules not reachable from the entry point, but those matching
+    keep patterns ( "plugins.*" ) loaded by dynamic imports, with their packages and
+    what they import. returns (packlist, [pruned logical names], bytes saved)
+    """
+    unreached = set(manifest["unreached"])
+
+    roots = []
+    for name in manifest["unreached"]:
+        if name.endswith(".py") and any(fnmatch.fnmatchcase(module_name(name), pattern) for pattern in keep):
+            roots.append(name)
+
+    kept = set(walk(folder, packlist, roots)[1])
+    for name in roots:
+        parent = posixpath.dirname(name)
+        while parent != "/":
+            kept.add(f"{parent}/__init__.py")
+            parent = posixpath.dirname(parent)
+
+    pruned = []
+    saved = 0
+    result = []
+    for name in packlist:
+        zname = logical(name)
+        if zname in unreached and zname.endswith(".py") and zname not in kept:
+            pruned.append(zname)
+            saved += (Path(folder) / name[1:]).stat().st_size
+        else:
+            result.append(name)
+
+    manifest["unreached"] = [name for name in manifest["unreached"] if name not in pruned]
+    manifest["pruned"] = pruned
+    return result, pruned, saved
+
+
+def write_manifest(manifest, filename):
+    with open(filename, "w", encoding="utf-8") as file:
+        json.dump(manifest, file, indent=1)
@@ -1,27 +1,320 @@
 import sys, os
+import asyncio
+import collections
+import concurrent.futures
+import copy
+import hashlib
+import json
+import struct
+import time
 import zipfile
+import zlib
 from pathlib import Path
 
-from .gathering import gather
-from .filtering import filter
-from .optimizing import optimize
+from .gathering import walk
+from .filtering import Matcher
+from .optimizing import optimize, file_hash
+from .ordering import order, prune, write_manifest
+from .compiling import compile_modules
 from .html_embed import html_embed
+from . import profiling
 
 COUNTER = 0
 UNSUPPORTED_CACHE = []
 OGG_CACHE = []
 
+# bytes of compressed members waiting for their turn in the apk, a single larger one still goes
+PENDING_BYTES = 64 << 20
+
+# duplicates smaller than that are packed again, an alias would not save much
+DEDUP_MINIMUM = 4096
+
 
 class REPLAY:
     HTML = False
     LIST = []
     APK = ""
     TARGET = ""
-
-
-async def pack_files(zf, packlist, zfolders, target_folder):
+    CACHE = None
+    POLICY = None
+    THREADS = 1
+    # (apk name, packlist, extra members) for core apk and content bundles
+    BUNDLES = []
+    # archive() arguments and matcher, to build again from scratch
+    ARGS = None
+    MATCHER = None
+    # (pyc, zip name) members of the core apk
+    PYC = []
+    # duplicates packed once, the template must mount aliases.json
+    DEDUP = False
+
+
+def zip_raw_read(zf, zinfo):
+    """compressed payload of a member, as stored"""
+    zf.fp.seek(zinfo.header_offset)
+    fheader = struct.unpack(zipfile.structFileHeader, zf.fp.read(zipfile.sizeFileHeader))
+    zf.fp.seek(fheader[zipfile._FH_FILENAME_LENGTH] + fheader[zipfile._FH_EXTRA_FIELD_LENGTH], 1)
+    return zf.fp.read(zinfo.compress_size)
+
+
+def zip_raw_write(zf, zinfo, raw):
+    """append an already compressed member, zinfo must carry CRC and sizes"""
+    # sizes are known, no data descriptor
+    zinfo.flag_bits &= ~0x08
+    with zf._lock:
+        zf._writecheck(zinfo)
+        zf._didModify = True
+        zf.fp.seek(zf.start_dir)
+        zinfo.header_offset = zf.fp.tell()
+        # same zip64 rule as ZipFile.write
+        zf.fp.write(zinfo.FileHeader(zinfo.file_size * 1.05 > zipfile.ZIP64_LIMIT))
+        zf.fp.write(raw)
+        zf.filelist.append(zinfo)
+        zf.NameToInfo[zinfo.filename] = zinfo
+        zf.start_dir = zf.fp.tell()
+
+
+def deflate_member(filename, arcname, method):
+    """
+    compress a file for zip_raw_write, giving the very same bytes as ZipFile.write
+    zlib releases the GIL so it can run in a thread pool.
+    """
+    t0 = time.perf_counter()
+    zinfo = zipfile.ZipInfo.from_file(filename, arcname)
+    if method == "stored":
+        zinfo.compress_type = zipfile.ZIP_STORED
+        compressor = None
+    else:
+        zinfo.compress_type = zipfile.ZIP_DEFLATED
+        compressor = zlib.compressobj(int(method.split(":", 1)[1]), zlib.DEFLATED, -15)
+
+    digest = hashlib.sha256()
+    crc = 0
+    size = 0
+    chunks = []
+    with open(filename, "rb") as file:
+        while True:
+            # same chunking as ZipFile.write
+            data = file.read(1024 * 8)
+            if not data:
+                break
+            size += len(data)
+            crc = zlib.crc32(data, crc)
+            digest.update(data)
+            chunks.append(compressor.compress(data) if compressor else data)
+    if compressor:
+        chunks.append(compressor.flush())
+
+    raw = b"".join(chunks)
+    zinfo.file_size = size
+    zinfo.CRC = crc
+    zinfo.compress_size = len(raw)
+    return zinfo, raw, digest.hexdigest(), time.perf_counter() - t0
+
+
+class CompressionPolicy:
+    """
+    per file type compression of apk members, as "stored" or "deflate:<level>".
+
+    pygbag.ini can override it with a list of "ext:level" entries in a
+    [COMPRESSION] section, level 0 meaning stored, eg
+        levels = ["dat:0", "tmx:9"]
+    unknown types are stored when a deflate sample does not shrink enough.
+    """
+
+    # already compressed formats, deflating them again only costs cpu on both ends
+    STORED = "png jpg jpeg gif webp avif ogg opus oga mp3 mp4 m4a webm woff woff2 whl zip apk jar gz tgz bz2 xz zst br 7z".split()
+
+    # text and code : small and very compressible, best ratio is worth it
+    TEXT = "py pyc pyi pyw json txt md html htm js mjs css svg xml csv tsv tmx tsx glsl vert frag ini cfg toml yml yaml".split()
+
+    DEFAULT = 6
+
+    SAMPLE = 1 << 14
+
+    def __init__(self, levels=(), threshold=0.95):
+        self.table = {}
+        for ext in self.STORED:
+            self.table[ext] = "stored"
+        for ext in self.TEXT:
+            self.table[ext] = "deflate:9"
+        for entry in levels or ():
+            ext, level = str(entry).rsplit(":", 1)
+            level = int(level)
+            self.table[ext.strip(". ").lower()] = "deflate:%d" % level if level else "stored"
+
+        self.threshold = float(threshold)
+
+        # stats for the build summary
+        self.stored = [0, 0]  # members, bytes
+        self.deflated = [0, 0, 0]  # members, bytes, compressed bytes
+        self.sampled = 0
+        self.deflate_time = 0.0
+        self.aliased = [0, 0]  # members, bytes
+
+    def method(self, filename):
+        ext = Path(filename).suffix[1:].lower()
+        method = self.table.get(ext)
+        if method is None:
+            with open(filename, "rb") as file:
+                sample = file.read(self.SAMPLE)
+            self.sampled += 1
+            if sample and len(zlib.compress(sample, 1)) > len(sample) * self.threshold:
+                method = "stored"
+            else:
+                method = f"deflate:{self.DEFAULT}"
+        return method
+
+    def account(self, zinfo, method, elapsed):
+        if method == "stored":
+            self.stored[0] += 1
+            self.stored[1] += zinfo.file_size
+        else:
+            self.deflated[0] += 1
+            self.deflated[1] += zinfo.file_size
+            self.deflated[2] += zinfo.compress_size
+            self.deflate_time += elapsed
+
+    def alias(self, size):
+        self.aliased[0] += 1
+        self.aliased[1] += size
+
+    def summary(self):
+        count, size, csize = self.deflated
+        if count:
+            print(f"    -> deflated {count} member(s) {size} -> {csize} bytes, {size - csize} saved in {self.deflate_time:.3f}s")
+        if self.stored[0]:
+            line = f"    -> stored {self.stored[0]} incompressible member(s) {self.stored[1]} bytes as is"
+            if size and self.deflate_time:
+                # estimated from this build deflate throughput
+                line += f", ~{self.stored[1] * self.deflate_time / size:.3f}s of deflate skipped"
+            print(line)
+        if self.sampled:
+            print(f"    -> {self.sampled} member(s) of unknown type sampled")
+        if self.aliased[0]:
+            print(f"    -> {self.aliased[0]} duplicate member(s) packed once, {self.aliased[1]} bytes saved")
+
+
+class Incremental:
+    """
+    member manifest (size, mtime, hash) of the previous apk, unchanged members
+    are copied byte for byte from it instead of being compressed again.
+    """
+
+    def __init__(self, apkname, manifest=None):
+        self.apkname = Path(apkname)
+        self.manifest = manifest and Path(manifest)
+        self.old = {}
+        self.new = {}
+        self.previous = None
+        self.reused = 0
+
+        if self.manifest and self.manifest.is_file() and self.apkname.is_file():
+            try:
+                self.old = json.loads(self.manifest.read_text())
+                self.previous = zipfile.ZipFile(self.apkname)
+            except (ValueError, OSError, zipfile.BadZipFile) as e:
+                print(f"incremental packing disabled for {self.apkname} : {e}")
+                self.old = {}
+
+    def reusable(self, name, st, filename, method):
+        # return hash of filename when previous apk holds the very same member
+        record = self.old.get(name)
+        if not record or record["method"] != method or record["size"] != st.st_size:
+            return None
+        if record["mtime"] == st.st_mtime_ns:
+            return record["hash"]
+        digest = file_hash(filename)
+        if digest == record["hash"]:
+            return digest
+        return None
+
+    def reuse(self, zip_content, zip_name, st, method):
+        # (zinfo, raw, hash) of the previous apk member when it is the very same
+        if not self.previous:
+            return None
+        name = Path(zip_name).as_posix()
+        digest = self.reusable(name, st, zip_content, method)
+        zinfo = self.previous.NameToInfo.get(name)
+        if not digest or zinfo is None:
+            return None
+        self.reused += 1
+        return copy.copy(zinfo), zip_raw_read(self.previous, zinfo), digest
+
+    def record(self, zip_name, st, digest, method):
+        self.new[Path(zip_name).as_posix()] = {"size": st.st_size, "mtime": st.st_mtime_ns, "hash": digest, "method": method}
+
+    def close(self):
+        if self.previous:
+            self.previous.close()
+            self.previous = None
+        if self.manifest:
+            self.manifest.parent.mkdir(parents=True, exist_ok=True)
+            tmp = self.manifest.with_name(f"{self.manifest.name}.tmp")
+            tmp.write_text(json.dumps(self.new, indent=1))
+            os.replace(tmp, self.manifest)
+
+
+def write_members(zf, members, incremental=None, policy=None, threads=1, dedup=False):
+    """
+    write (filename, zip name) members to zf : they are compressed in a pool of
+    threads but appended in order, so the apk does not depend on threads count.
+    with dedup a file identical to a previous member of at least DEDUP_MINIMUM
+    bytes is not written again, returns the {alias zip name: packed zip name} of those.
+    """
+    policy = policy or CompressionPolicy()
+    pending = collections.deque()
+    # source sizes of pending members, compressed ones are not larger
+    pending_bytes = 0
+
+    # only files sharing their size with another one need hashing
+    sizes = collections.Counter(zip_content.stat().st_size for zip_content, zip_name in members) if dedup else {}
+    sizes = {size: count for size, count in sizes.items() if size >= DEDUP_MINIMUM}
+    packed = {}
+    aliases = {}
+
+    def flush(keep, limit=PENDING_BYTES):
+        nonlocal pending_bytes
+        while len(pending) > keep or (pending and pending_bytes > limit):
+            zip_content, zip_name, st, method, reused, job = pending.popleft()
+            pending_bytes -= st.st_size
+            zinfo, raw, digest, elapsed = job.result()
+            zip_raw_write(zf, zinfo, raw)
+            profiling.member(zip_name, zip_content, zinfo, method)
+            if incremental:
+                incremental.record(zip_name, st, digest, method)
+            if not reused:
+                policy.account(zinfo, method, elapsed)
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, threads)) as pool:
+        for zip_content, zip_name in members:
+            st = zip_content.stat()
+            if sizes.get(st.st_size, 0) > 1:
+                first = packed.setdefault(file_hash(zip_content), zip_name)
+                if first != zip_name:
+                    aliases[Path(zip_name).as_posix()] = Path(first).as_posix()
+                    policy.alias(st.st_size)
+                    profiling.alias(zip_name, zip_content, first)
+                    continue
+            method = policy.method(zip_content)
+            # room for this one first, bound memory held by compressed payloads waiting for their turn
+            flush(4 * threads - 1, PENDING_BYTES - st.st_size)
+            found = incremental and incremental.reuse(zip_content, zip_name, st, method)
+            if found:
+                job = concurrent.futures.Future()
+                job.set_result((*found, 0.0))
+            else:
+                job = pool.submit(deflate_member, zip_content, zip_name, method)
+            pending.append((zip_content, zip_name, st, method, bool(found), job))
+            pending_bytes += st.st_size
+        flush(0)
+    return aliases
+
+
+def collect(packlist, zfolders, target_folder):
     global COUNTER
 
+    members = []
     for asset in packlist:
         asset_name = str(asset)[1:]
 
@@ -48,16 +341,113 @@ async def pack_files(zf, packlist, zfolders, target_folder):
         zip_name = Path("/".join(zpath))
         # TODO: TEST SHEBANG for .html -> .py extension
         COUNTER += 1
-        zf.write(zip_content, zip_name)
+        members.append((zip_content, zip_name))
+    return members
+
+
+async def pack_files(zf, packlist, zfolders, target_folder, incremental=None, policy=None, threads=1):
+    write_members(zf, collect(packlist, zfolders, target_folder), incremental, policy, threads)
+
+
+def write_apk(apkname, members, policy=None, threads=1, extra=None, dedup=False):
+    """(re)write apkname from members, extra maps zip names to generated content"""
+    # previous apk is kept until replaced, so unchanged members can be copied from it.
+    manifest = REPLAY.CACHE and Path(REPLAY.CACHE) / f"{Path(apkname).name}.json"
+    incremental = Incremental(apkname, manifest)
+    tmpname = f"{apkname}.tmp"
+    with zipfile.ZipFile(tmpname, mode="w") as zf:
+        aliases = write_members(zf, members, incremental, policy, threads, dedup)
+        extra = dict(extra or {})
+        if aliases:
+            # duplicates are made again from their packed copy when the apk is mounted
+            extra["aliases.json"] = json.dumps(aliases, indent=1)
+        for name, data in extra.items():
+            zf.writestr(name, data, compress_type=zipfile.ZIP_DEFLATED, compresslevel=9)
+    incremental.close()
+    os.replace(tmpname, apkname)
+    return incremental
+
+
+def bundle_files(apkname):
+    """content bundles apk next to the core one"""
+    apk = Path(apkname)
+    stem = apk.stem
+    return sorted(
+        (bundle for bundle in apk.parent.glob(f"{stem}-*.apk") if bundle.stem[len(stem) + 1 :].isdigit()),
+        key=lambda bundle: int(bundle.stem[len(stem) + 1 :]),
+    )
+
+
+def split_bundles(target_folder, packlist, manifest, mainscript, limit, dedup=False):
+    """
+    core gets the code and what the entry script references directly,
+    other files go in reachability order into bundles of at most limit bytes.
+    with dedup duplicates follow their first copy, so they can be packed as aliases of it.
+    """
+    entry = f"/{mainscript}"
+    boot = set(item["name"] for item in manifest["order"] if item["from"] in (None, entry))
+
+    sizes = collections.Counter((target_folder / name[1:]).stat().st_size for name in packlist) if dedup else {}
+    # content hash -> list holding its first copy
+    placed = {}
+
+    core = []
+    bundles = []
+    size = 0
+    for name in packlist:
+        zname = name.replace("-pygbag.", ".")
+        fsize = (target_folder / name[1:]).stat().st_size
+        digest = fsize >= DEDUP_MINIMUM and sizes.get(fsize, 0) > 1 and file_hash(target_folder / name[1:])
+        if digest in placed:
+            placed[digest].append(name)
+            continue
+        if zname.endswith(".py") or zname in boot:
+            core.append(name)
+        else:
+            if not bundles or (size + fsize > limit and bundles[-1]):
+                bundles.append([])
+                size = 0
+            bundles[-1].append(name)
+            size += fsize
+        if digest:
+            placed[digest] = core if core and core[-1] is name else bundles[-1]
+    return core, bundles
+
+
+def replay_changes(changed=None):
+    """
+    bring apk files up to date after changes to the app folder files reported
+    by a watcher, None meaning unknown. Returns False when nothing was done.
+    """
+    if changed is None:
+        stream_pack_replay()
+        return True
+
+    missing = [name for name, part, extra in REPLAY.BUNDLES if not os.path.isfile(name)]
+    if not changed and not missing:
+        return False
+
+    print(f"changed : {' '.join(sorted(changed)) or '-'}")
+
+    # files packed as they are only need their members refreshed, anything else
+    # (sources of optimized files, python, new or removed files) is a full build.
+    packed = set()
+    for name, part, extra in REPLAY.BUNDLES:
+        packed.update(part)
+    if not missing and all(rel in packed and not rel.endswith(".py") for rel in changed):
+        stream_pack_replay()
+    else:
+        asyncio.run(archive(*REPLAY.ARGS[0], **REPLAY.ARGS[1]))
+    return True
 
 
 def stream_pack_replay():
     global COUNTER, REPLAY
-    if os.path.isfile(REPLAY.APK):
-        os.unlink(REPLAY.APK)
+    policy = REPLAY.POLICY or CompressionPolicy()
     zfolders = ["assets"]
-    with zipfile.ZipFile(REPLAY.APK, mode="x", compression=zipfile.ZIP_DEFLATED, compresslevel=9) as zf:
-        for asset in REPLAY.LIST:
+    for apkname, packlist, extra in REPLAY.BUNDLES:
+        members = []
+        for asset in packlist:
             zpath = list(zfolders)
             zpath.insert(0, str(REPLAY.TARGET))
             zpath.append(str(asset)[1:])
@@ -70,59 +460,124 @@ def stream_pack_replay():
                 print("59: ERROR", zip_content)
                 break
             zip_name = Path("/".join(zpath))
-            zf.write(zip_content, zip_name)
+            members.append((zip_content, zip_name))
+
+        if apkname == REPLAY.APK:
+            members.extend(REPLAY.PYC)
 
-    print(f"replay packing {len(REPLAY.LIST)=} files complete for {REPLAY.APK}")
+        incremental = write_apk(apkname, members, policy, REPLAY.THREADS, extra, REPLAY.DEDUP)
+        print(f"replay packing {len(packlist)=} files complete for {apkname} ({incremental.reused} unchanged)")
 
 
-async def archive(apkname, target_folder, ignore_dirs:list[str], ignore_files:list[str], build_dir=None):
+async def archive(apkname, target_folder, ignore_dirs:list[str], ignore_files:list[str], build_dir=None, cache_dir=None, jobs=0, compression=None, mainscript="main.py", bundle_size=0, pybuild=None, pyc_optimize=0, prune_modules=False, keep_modules=(), dedup=False):
     global COUNTER, REPLAY
 
     COUNTER = 0
+    # filled again by collect(), archive() runs at each rebuild
+    UNSUPPORTED_CACHE.clear()
+    OGG_CACHE.clear()
+
+    REPLAY.ARGS = (
+        (apkname, target_folder, ignore_dirs, ignore_files, build_dir, cache_dir),
+        dict(
+            jobs=jobs,
+            compression=compression,
+            mainscript=mainscript,
+            bundle_size=bundle_size,
+            pybuild=pybuild,
+            pyc_optimize=pyc_optimize,
+            prune_modules=prune_modules,
+            keep_modules=keep_modules,
+            dedup=dedup,
+        ),
+    )
 
     if build_dir:
         apkname = build_dir.joinpath(apkname).as_posix()
 
-    walked = []
-    for folder, filenames in gather(target_folder):
-        walked.append([folder, filenames])
-        sched_yield()
+    REPLAY.MATCHER = matcher = Matcher(target_folder, ignore_dirs, ignore_files)
 
     filtered = []
     last = ""
-    for infolder, fullpath in filter(walked, ignore_dirs, ignore_files):
-        if last != infolder:
-            print(f"Now in {infolder}")
-            last = infolder
+    # gathering and filtering are a single pass
+    with profiling.stage("gather+filter"):
+        for infolder, fullpath in walk(target_folder, matcher):
+            if last != infolder:
+                print(f"Now in {infolder}")
+                last = infolder
 
-        print(" " * 4, fullpath)
-        filtered.append(fullpath)
-        sched_yield()
+            print(" " * 4, fullpath)
+            filtered.append(fullpath)
+            sched_yield()
 
     packlist = []
-    for filename in optimize(target_folder, filtered):
-        packlist.append(filename)
-        sched_yield()
+    with profiling.stage("optimize"):
+        for filename in optimize(target_folder, filtered, cache_dir=cache_dir, jobs=jobs):
+            packlist.append(filename)
+            sched_yield()
+
+    # first needed, first packed
+    with profiling.stage("order"):
+        packlist, manifest = order(target_folder, packlist, mainscript)
+        if prune_modules:
+            packlist, pruned, saved = prune(target_folder, packlist, manifest, keep_modules)
+        write_manifest(manifest, f"{apkname[:-4]}.order.json")
+    print(f"{len(manifest['order'])} files reachable from {mainscript}, {len(manifest['unreached'])} not referenced")
+
+    if prune_modules:
+        print(f"    -> pruned {len(pruned)} module(s) never imported from {mainscript}, {saved} bytes saved")
+        for name in pruned:
+            print(f"\t{name}")
+        for module, line in manifest["dynamic"].items():
+            print(f"    -> WARNING: {module}:{line} imports a computed module name, list what it loads in pygbag.ini [MODULES] keep")
 
     REPLAY.LIST = packlist
     REPLAY.APK = apkname
     REPLAY.TARGET = target_folder
+    REPLAY.CACHE = cache_dir
+    REPLAY.POLICY = policy = CompressionPolicy(**(compression or {}))
+    REPLAY.THREADS = threads = jobs or os.cpu_count() or 1
+    REPLAY.BUNDLES = [(apkname, packlist, None)]
+    REPLAY.DEDUP = dedup
 
     if "--html" in sys.argv:
         REPLAY.HTML = True
-        html_embed(target_folder, packlist, apkname[:-4] + ".html")
+        with profiling.stage("html_embed"):
+            html_embed(target_folder, packlist, apkname[:-4] + ".html")
         return
 
-    try:
-        with zipfile.ZipFile(apkname, mode="x", compression=zipfile.ZIP_DEFLATED, compresslevel=9) as zf:
-            # pack_files(zf, Path.cwd(), ["assets"], target_folder)
-            await pack_files(zf, packlist, ["assets"], target_folder)
-
-    except TypeError:
-        # 3.6 does not support compresslevel
-        with zipfile.ZipFile(apkname, mode="x", compression=zipfile.ZIP_DEFLATED) as zf:
-            # pack_files(zf, Path.cwd(), ["assets"], target_folder)
-            await pack_files(zf, packlist, ["assets"], target_folder)
+    REPLAY.PYC = []
+    if pybuild:
+        with profiling.stage("compile"):
+            REPLAY.PYC = compile_modules(target_folder, packlist, pybuild, pyc_optimize, cache_dir, mainscript)
+
+    if bundle_size:
+        core, parts = split_bundles(target_folder, packlist, manifest, mainscript, bundle_size, dedup)
+        names = [f"{apkname[:-4]}-{idx}.apk" for idx in range(1, len(parts) + 1)]
+        index = {
+            "core": Path(apkname).name,
+            "size": bundle_size,
+            "bundles": {Path(name).name: ["assets/" + asset[1:].replace("-pygbag.", ".") for asset in part] for name, part in zip(names, parts)},
+        }
+        REPLAY.LIST = core
+        REPLAY.BUNDLES = [(apkname, core, {"bundles.json": json.dumps(index, indent=1)})]
+        REPLAY.BUNDLES.extend((name, part, None) for name, part in zip(names, parts))
+
+    # leftovers of a previous build with more bundles
+    for stale in bundle_files(apkname):
+        if stale.as_posix() not in [name for name, part, extra in REPLAY.BUNDLES]:
+            stale.unlink()
+
+    reused = 0
+    sizes = []
+    with profiling.stage("pack_files"):
+        for name, part, extra in REPLAY.BUNDLES:
+            members = collect(part, ["assets"], target_folder)
+            if name == apkname:
+                members.extend(REPLAY.PYC)
+            incremental = write_apk(name, members, policy, threads, extra, dedup)
+            reused += incremental.reused
+            sizes.append(os.stat(name).st_size)
 
     for unsupported_name, suffix in UNSUPPORTED_CACHE:
         found_ogg = False
@@ -136,7 +591,14 @@ async def archive(apkname, target_folder, ignore_dirs:list[str], ignore_files:li
                 "Use OGG format instead. Suppress this error with the '--disable-sound-format-error' option."
             )
 
-    print(f"packing {COUNTER} files complete")
+    print(f"packing {COUNTER} files complete, {reused} unchanged")
+    policy.summary()
+    if len(sizes) > 1:
+        total = sum(sizes)
+        print(
+            f"    -> core {Path(apkname).name} {sizes[0]} bytes, {100 - sizes[0] * 100 // total}% smaller than a single apk of {total} bytes"
+        )
+        print(f"    -> {len(sizes) - 1} content bundle(s) of at most {bundle_size} bytes fetched on first use")
 
 
 async def web_archive(apkname, build_dir):
@@ -147,3 +609,5 @@ async def web_archive(apkname, build_dir):
     with zipfile.ZipFile(archfile, mode="x", compression=zipfile.ZIP_STORED) as zf:
         for f in ("index.html", "favicon.png", apkname):
             zf.write(build_dir.joinpath(f), f)
+        for bundle in bundle_files(build_dir.joinpath(apkname)):
+            zf.write(bundle, bundle.name)
@@ -0,0 +1,158 @@
+"""
+build profiler for pygbag --profile-build
+
+stages and external tools are always timed, it is cheap. Only with
+--profile-build a report is written to build/build-report.json and the
+worst offenders are printed at the end of the build.
+"""
+
+import json
+import os
+import subprocess
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+
+class PROFILE:
+    ENABLED = False
+    # [stage, seconds] in completion order
+    STAGES = []
+    # {"tool", "cmd", "seconds", "returncode"}
+    TOOLS = []
+    # optimized file -> the file it was produced from
+    SOURCES = {}
+    # zip name -> sizes of an apk member
+    MEMBERS = {}
+    lock = threading.Lock()
+
+
+@contextmanager
+def stage(name):
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        with PROFILE.lock:
+            PROFILE.STAGES.append([name, time.perf_counter() - t0])
+
+
+def tool(cmd, seconds, returncode=None):
+    with PROFILE.lock:
+        PROFILE.TOOLS.append(
+            {
+                "tool": Path(str(cmd[0])).name,
+                "cmd": " ".join(map(str, cmd)),
+                "seconds": seconds,
+                "returncode": returncode,
+            }
+        )
+
+
+def run(cmd, **kw):
+    """timed subprocess.run"""
+    t0 = time.perf_counter()
+    proc = None
+    try:
+        proc = subprocess.run(cmd, **kw)
+        return proc
+    finally:
+        tool(cmd, time.perf_counter() - t0, proc and proc.returncode)
+
+
+def popen(cmdline):
+    """timed os.popen(cmdline).read()"""
+    t0 = time.perf_counter()
+    try:
+        return os.popen(cmdline).read()
+    finally:
+        tool(cmdline.split(None, 1), time.perf_counter() - t0)
+
+
+def source(optimized, original):
+    with PROFILE.lock:
+        PROFILE.SOURCES[str(optimized)] = str(original)
+
+
+def member(zip_name, filename, zinfo, method):
+    original = PROFILE.SOURCES.get(str(filename), str(filename))
+    try:
+        original_size = os.stat(original).st_size
+    except OSError:
+        original_size = zinfo.file_size
+    with PROFILE.lock:
+        PROFILE.MEMBERS[Path(zip_name).as_posix()] = {
+            "source": original,
+            "original": original_size,
+            "optimized": zinfo.file_size,
+            "compressed": zinfo.compress_size,
+            "method": method,
+        }
+
+
+def alias(zip_name, filename, target):
+    # a duplicate of target, not packed
+    size = os.stat(filename).st_size
+    with PROFILE.lock:
+        PROFILE.MEMBERS[Path(zip_name).as_posix()] = {
+            "source": str(filename),
+            "original": size,
+            "optimized": size,
+            "compressed": 0,
+            "method": "alias",
+            "alias": Path(target).as_posix(),
+        }
+
+
+def report(filename, top=10):
+    """write the json report and print the top offenders, when enabled"""
+    if not PROFILE.ENABLED:
+        return
+
+    members = PROFILE.MEMBERS
+    tools = {}
+    for entry in PROFILE.TOOLS:
+        count, seconds = tools.get(entry["tool"], (0, 0.0))
+        tools[entry["tool"]] = (count + 1, seconds + entry["seconds"])
+
+    data = {
+        "stages": [{"stage": name, "seconds": round(seconds, 6)} for name, seconds in PROFILE.STAGES],
+        "tools": {name: {"count": count, "seconds": round(seconds, 6)} for name, (count, seconds) in tools.items()},
+        "invocations": PROFILE.TOOLS,
+        "members": members,
+        "total": {
+            "original": sum(item["original"] for item in members.values()),
+            "optimized": sum(item["optimized"] for item in members.values()),
+            "compressed": sum(item["compressed"] for item in members.values()),
+            "dedup": sum(item["optimized"] for item in members.values() if item["method"] == "alias"),
+        },
+    }
+
+    filename = Path(filename)
+    filename.parent.mkdir(parents=True, exist_ok=True)
+    tmp = filename.with_name(f"{filename.name}.tmp")
+    tmp.write_text(json.dumps(data, indent=1))
+    os.replace(tmp, filename)
+
+    print(f"\nbuild profile written to {filename}")
+    print("    stages :")
+    for name, seconds in sorted(PROFILE.STAGES, key=lambda item: -item[1])[:top]:
+        print(f"        {seconds:9.3f}s  {name}")
+
+    if tools:
+        print("    external tools :")
+        for name, (count, seconds) in sorted(tools.items(), key=lambda item: -item[1][1])[:top]:
+            print(f"        {seconds:9.3f}s  {name} x{count}")
+        print("    slowest invocations :")
+        for entry in sorted(PROFILE.TOOLS, key=lambda item: -item["seconds"])[:top]:
+            print(f"        {entry['seconds']:9.3f}s  {entry['cmd'][:100]}")
+
+    if members:
+        print("    largest apk members :                    original  optimized compressed")
+        for name, item in sorted(members.items(), key=lambda item: -item[1]["compressed"])[:top]:
+            print(f"        {name[-36:]:<36} {item['original']:>10} {item['optimized']:>10} {item['compressed']:>10}")
+        total = data["total"]
+        print(f"        {'total':<36} {total['original']:>10} {total['optimized']:>10} {total['compressed']:>10}")
+        if total["dedup"]:
+            print(f"        {total['dedup']} bytes of duplicates packed once")
@@ -331,3 +331,261 @@ window.Fetch.GET = function * GET (url)
 
     # def post(self, url, data=None):
     #     return await self._post(url, data)
+
+
+# identical files are packed once, the apk aliases.json lists the other names.
+
+
+def aliases_make(root, aliases):
+    import shutil
+
+    root = Path(root)
+    for alias, packed in aliases.items():
+        target = root / alias
+        if target.exists():
+            continue
+        target.parent.mkdir(parents=True, exist_ok=True)
+        try:
+            os.link(root / packed, target)
+        except OSError:
+            # no hard links on browser filesystems
+            shutil.copyfile(root / packed, target)
+    return len(aliases)
+
+
+def aliases_mount(root, manifest="aliases.json"):
+    """recreate duplicated files of a mounted apk"""
+    index = Path(root) / manifest
+    if not index.is_file():
+        return 0
+    with open(index, "r") as file:
+        count = aliases_make(root, json.load(file))
+    if not FS_SILENT:
+        print(f"aliases: {count} duplicate file(s) restored")
+    return count
+
+
+# content bundles split out of the apk by pygbag --bundle_size
+# they are listed in bundles.json at the root of the core apk.
+
+bundles = {}
+bundled = {}
+bundle_root = None
+bundles_hooked = False
+
+
+def bundles_mount(root, manifest="bundles.json", base_url=""):
+    """index content bundles, each one is fetched on first open of any path inside it"""
+    global bundle_root
+
+    root = Path(root)
+    index = root / manifest
+    if not index.is_file():
+        return 0
+
+    with open(index, "r") as file:
+        data = json.load(file)
+
+    bundle_root = root
+    for name, files in data["bundles"].items():
+        bundles[name] = {"url": base_url + name, "files": files, "ready": False}
+        for filename in files:
+            bundled[os.path.normpath(root / filename)] = name
+
+    bundles_hook()
+    if not FS_SILENT:
+        print(f"bundles: {len(bundles)} lazy bundle(s) for {len(bundled)} files")
+    return len(bundles)
+
+
+def bundle_of(path):
+    # name of the bundle holding path if not already fetched
+    try:
+        path = os.path.normpath(Path(path).absolute())
+    except (TypeError, ValueError):
+        return None
+    name = bundled.get(path)
+    if name and not bundles[name]["ready"]:
+        return name
+    return None
+
+
+def bundle_extract(name, archive):
+    import zipfile
+
+    # extractall opens the very files being waited for
+    bundles[name]["ready"] = True
+    try:
+        with zipfile.ZipFile(archive) as zf:
+            names = zf.namelist()
+            zf.extractall(bundle_root, [name for name in names if name != "aliases.json"])
+            if "aliases.json" in names:
+                aliases_make(bundle_root, json.loads(zf.read("aliases.json")))
+    except:
+        bundles[name]["ready"] = False
+        raise
+    if FS_DEBUG:
+        print(f"bundles: {name} ready")
+
+
+def bundle_fetch_sync(name):
+    import tempfile
+    import urllib.request
+
+    url = bundles[name]["url"]
+    localfile = Path(url)
+    if url.find("://") < 0 and localfile.is_file():
+        # simulator, or app served from local files
+        bundle_extract(name, localfile)
+        return
+
+    # on browser urlretrieve is a blocking XHR
+    filename, _ = urllib.request.urlretrieve(url, Path(tempfile.gettempdir()) / name)
+    try:
+        bundle_extract(name, filename)
+    finally:
+        os.unlink(filename)
+
+
+async def bundle_fetch(name):
+    if bundles[name]["ready"]:
+        return
+    if sys.platform in ("emscripten", "wasi"):
+        async with platform.fopen(bundles[name]["url"], "rb") as source:
+            bundle_extract(name, source)
+    else:
+        bundle_fetch_sync(name)
+
+
+async def need(*paths):
+    """fetch in advance the bundles holding paths, a folder stands for every file below it"""
+    wanted = []
+    for path in paths:
+        path = os.path.normpath(Path(path).absolute())
+        for filename, name in bundled.items():
+            if filename == path or filename.startswith(path + os.sep):
+                if name not in wanted:
+                    wanted.append(name)
+    for name in wanted:
+        await bundle_fetch(name)
+        await asyncio.sleep(0)
+
+
+async def bundles_prefetch():
+    """fetch all remaining bundles in order, eg from a background task once the game is running"""
+    for name in list(bundles):
+        await bundle_fetch(name)
+        await asyncio.sleep(0)
+
+
+def fs_hook(fetch, fetch_folder):
+    """
+    fetch(path) runs before a file is opened, stat or loaded by pygame, and
+    fetch_folder(path) before a folder is listed, so files can be made on first use.
+    """
+    import builtins
+    import io
+
+    def hooked(fn):
+        def call(file, *argv, **kw):
+            if isinstance(file, (str, os.PathLike)):
+                fetch(file)
+            return fn(file, *argv, **kw)
+
+        return call
+
+    def hooked_class(cls):
+        try:
+
+            class Hooked(cls):
+                def __init__(self, *argv, **kw):
+                    if argv and isinstance(argv[0], (str, os.PathLike)):
+                        fetch(argv[0])
+                    super().__init__(*argv, **kw)
+
+        except TypeError:
+            # final type
+            return cls
+        Hooked.__name__ = Hooked.__qualname__ = cls.__name__
+        return Hooked
+
+    def listed(fn):
+        def call(path=".", *argv, **kw):
+            if isinstance(path, (str, os.PathLike)):
+                fetch_folder(path)
+            return fn(path, *argv, **kw)
+
+        return call
+
+    def pygame_hook(pygame):
+        # SDL opens files on its own
+        for names, attr in ((["image"], "load"), (["mixer", "music"], "load"), (["mixer"], "Sound"), (["font"], "Font")):
+            try:
+                owner = pygame
+                for name in names:
+                    owner = getattr(owner, name)
+                fn = getattr(owner, attr)
+            except (AttributeError, ImportError, NotImplementedError):
+                continue
+            setattr(owner, attr, hooked_class(fn) if isinstance(fn, type) else hooked(fn))
+
+    class PygameFinder:
+        # hooks pygame loaders once pygame is imported
+        pending = True
+
+        def find_spec(self, fullname, path=None, target=None):
+            if fullname != "pygame" or not self.pending:
+                return None
+            self.pending = False
+
+            import importlib.util
+
+            spec = importlib.util.find_spec(fullname)
+            if spec and spec.loader and not isinstance(spec.loader, type):
+                exec_module = spec.loader.exec_module
+
+                def exec_pygame(module):
+                    exec_module(module)
+                    pygame_hook(module)
+
+                spec.loader.exec_module = exec_pygame
+            return spec
+
+    builtins.open = io.open = hooked(builtins.open)
+    # os.path.exists, isfile, getsize, pathlib ... all stat first
+    os.stat = hooked(os.stat)
+    # glob, os.walk, Path.iterdir
+    os.listdir = listed(os.listdir)
+    os.scandir = listed(os.scandir)
+
+    if "pygame" in sys.modules:
+        pygame_hook(sys.modules["pygame"])
+    else:
+        sys.meta_path.insert(0, PygameFinder())
+
+
+def bundle_need(path):
+    # an access to a file not yet fetched blocks until its bundle arrives.
+    name = bundle_of(path)
+    if name:
+        bundle_fetch_sync(name)
+
+
+def bundle_need_folder(path):
+    # a listing shows the files of every bundle holding some in that folder
+    try:
+        folder = os.path.normpath(Path(path).absolute())
+    except (TypeError, ValueError):
+        return
+    for filename, name in list(bundled.items()):
+        if not bundles[name]["ready"] and os.path.dirname(filename) == folder:
+            bundle_fetch_sync(name)
+
+
+def bundles_hook():
+    global bundles_hooked
+
+    if bundles_hooked:
+        return
+    bundles_hooked = True
+    fs_hook(bundle_need, bundle_need_folder)
@@ -13,6 +13,7 @@ if ".wasm" not in mimetypes.types_map:
     mimetypes.types_map[".wasm"] = "application/wasm"
 
 
+import asyncio
 from functools import partial
 from http.server import *
 from http import HTTPStatus
@@ -27,8 +28,18 @@ import io
 
 import urllib.request
 import hashlib
+import http.client
+import time
+import threading
 from pathlib import Path
 
+from . import compressing
+from . import monitoring
+from . import throttling
+from . import web
+from .monitoring import METRICS
+from .caching import CdnCache
+
 
 # on first load be verbose
 VERB = True
@@ -48,12 +59,227 @@ try:
     if app.AUTO_REBUILD:
         from . import pack
 
-        AUTO_REBUILD = pack.stream_pack_replay
+        AUTO_REBUILD = pack.replay_changes
 except:
     AUTO_REBUILD = False
 
+# app folder watcher, repacking only happens when it saw changes
+WATCHER = None
+REBUILD_LOCK = threading.Lock()
+
+# path -> (mtime_ns, size, strong etag)
+ETAGS = {}
+
+# throttling.Throttle when emulating a slow network
+THROTTLE = None
+
+
+def etag(path, fs):
+    """strong validator from content hash, computed again only when file changed"""
+    stamp = (fs.st_mtime_ns, fs.st_size)
+    known = ETAGS.get(path)
+    if known and known[:2] == stamp:
+        return known[2]
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        while True:
+            chunk = file.read(1 << 20)
+            if not chunk:
+                break
+            digest.update(chunk)
+    tag = f'"{digest.hexdigest()[:32]}"'
+    ETAGS[path] = (*stamp, tag)
+    return tag
+
+
+# cached CDN headers never forwarded, they are the test server's own or describe a full response
+NOT_FORWARDED = (
+    "content-length",
+    "content-range",
+    "accept-ranges",
+    "etag",
+    "connection",
+    "keep-alive",
+    "transfer-encoding",
+    "vary",
+    "access-control-allow-origin",
+    "cross-origin-embedder-policy",
+    "cross-origin-resource-policy",
+    "cross-origin-opener-policy",
+)
+
+
+def stored_headers(entry):
+    """(headers, origin etag) of a cached CDN file, lowercase keys"""
+    headers = {}
+    validator = ""
+    for k, v in entry:
+        k = k.lower()
+        if k == "etag":
+            validator = v
+        if k not in NOT_FORWARDED:
+            headers[k] = v
+    return headers, validator
+
+
+def byte_ranges(spec, size):
+    """
+    [(first, last)] byte positions of a Range header for a size bytes body, []
+    when none is satisfiable, None when the header is to be ignored.
+    """
+    unit, _, sets = spec.partition("=")
+    if unit.strip().lower() != "bytes":
+        return None
+    ranges = []
+    for item in sets.split(","):
+        first, sep, last = item.strip().partition("-")
+        try:
+            if not sep:
+                return None
+            if not first:
+                # suffix, the last bytes
+                count = int(last)
+                if count:
+                    ranges.append((max(0, size - count), size - 1))
+                continue
+            first = int(first)
+            last = int(last) if last else max(first, size - 1)
+        except ValueError:
+            return None
+        if last < first:
+            return None
+        if first < size:
+            last = min(last, size - 1)
+            ranges.append((first, last))
+    return ranges
+
+
+class Slices:
+    """body made of file parts (offset, count) and bytes, eg a multipart/byteranges one"""
+
+    def __init__(self, file, items):
+        self.file = file
+        self.items = items
+
+    def size(self):
+        return sum(len(item) if isinstance(item, bytes) else item[1] for item in self.items)
+
+    def read(self, size=-1):
+        while self.items:
+            item = self.items[0]
+            if isinstance(item, bytes):
+                self.items.pop(0)
+                if item:
+                    return item
+                continue
+            offset, count = item
+            self.file.seek(offset)
+            data = self.file.read(count if size is None or size < 0 else min(size, count))
+            if len(data) < count and data:
+                self.items[0] = (offset + len(data), count - len(data))
+            else:
+                self.items.pop(0)
+            if data:
+                return data
+        return b""
+
+    def close(self):
+        self.file.close()
+
+
+class Rewritten:
+    """a transformed file, and its encoded variants made on demand"""
+
+    def __init__(self, stamp, content):
+        self.stamp = stamp
+        self.content = content
+        self.length = len(content)
+        self.tag = f'"{hashlib.sha256(content).hexdigest()[:32]}"'
+        self.encoded = {}
+
+    def encode(self, token):
+        """content with encoding token, None when it does not pay"""
+        if token not in self.encoded:
+            content = compressing.encode(self.content, token)
+            self.encoded[token] = content if len(content) <= self.length * compressing.THRESHOLD else None
+        return self.encoded[token]
+
+
+# file path -> Rewritten, valid while the file mtime, size and transformer are the same
+REWRITES = {}
+
+
+def rewrite(f, fs, transform, path):
+    """Rewritten of an open file, cached unless it is a CDN file still downloading"""
+    stamp = (fs.st_mtime_ns, fs.st_size, transform) if fs else None
+    known = REWRITES.get(f.name) if fs else None
+    if known and known.stamp == stamp:
+        return known
+    rewritten = Rewritten(stamp, transform(f.read(), path))
+    if fs:
+        REWRITES[f.name] = rewritten
+    return rewritten
+
+
+# extension -> transform(content, path) returning the bytes to serve instead of a
+# file content, eg to add .js or .json ones :
+#     @transformer(".js", ".json")
+#     def my_rewrite(content, path): ...
+TRANSFORMERS = {}
+
+
+def transformer(*extensions):
+    def register(fn):
+        for ext in extensions:
+            TRANSFORMERS[ext.lower()] = fn
+        return fn
+
+    return register
+
+
+@transformer(".html")
+def rewrite_cdn(content, path):
+    if VERB:
+        print("REPLACING", path, CDN, PROXY)
+
+    # redirect known CDN to relative path
+    # FIXME: py*-scripts
+    #                content = content.replace(
+    #                    b"https://pygame-web.github.io", b"http://localhost:8000"
+    #                )
+
+    # redirect user CDN to localhost
+    return content.replace(BCDN, BPROXY)
+
+
+if fstring_decode:
+
+    @transformer(".py")
+    def decode_fstrings(content, path):
+        content, _ = fstring_decode(content)
+        return content.encode("UTF-8")
+
+
+def upstream(url):
+    """web.stream of a CDN file, timed until the last byte"""
+    t0 = time.perf_counter()
+    headers, length, chunks = web.stream(url)
+
+    def timed():
+        yield from chunks
+        METRICS.UPSTREAM.observe(time.perf_counter() - t0)
+
+    return headers, length, timed()
+
 
 class CodeHandler(SimpleHTTPRequestHandler):
+    def setup(self):
+        super().setup()
+        if THROTTLE:
+            # connection handshake
+            time.sleep(THROTTLE.delay())
+            self.wfile = throttling.Paced(self.wfile, THROTTLE.bucket())
+
     def end_headers(self):
         self.send_header("access-control-allow-origin", "*")
         self.send_header("cross-origin-resource-policy:", "cross-origin")
@@ -73,18 +299,39 @@ class CodeHandler(SimpleHTTPRequestHandler):
 
         super().end_headers()
 
+    def send_response(self, code, message=None):
+        METRICS.STATUS.inc(int(code))
+        super().send_response(code, message)
+
+    def send_header(self, keyword, value):
+        # body size, for metrics
+        if keyword.lower() == "content-length":
+            self.length = int(value)
+        super().send_header(keyword, value)
+
     def do_GET(self):
+        if THROTTLE:
+            time.sleep(THROTTLE.delay())
+        t0 = time.perf_counter()
+        self.length = 0
         f = self.send_head()
         if f:
             try:
                 self.copyfile(f, self.wfile)
             finally:
                 f.close()
+        METRICS.REQUEST.observe(time.perf_counter() - t0)
+        METRICS.SENT.observe(self.length)
 
     def do_HEAD(self):
+        if THROTTLE:
+            time.sleep(THROTTLE.delay())
+        t0 = time.perf_counter()
         f = self.send_head()
         if f:
             f.close()
+        METRICS.REQUEST.observe(time.perf_counter() - t0)
+        METRICS.SENT.observe(0)
 
     def send_head(self):
         global VERB, CDN, PROXY, BCDN, BPROXY, AUTO_REBUILD
@@ -97,6 +344,29 @@ class CodeHandler(SimpleHTTPRequestHandler):
 """
             )
 
+        if self.path == monitoring.PATH:
+            content = monitoring.text()
+            self.send_response(HTTPStatus.OK)
+            self.send_header("Content-type", monitoring.CONTENT_TYPE)
+            self.send_header("Cache-Control", "no-store")
+            self.send_header("content-length", str(len(content)))
+            self.end_headers()
+            return io.BytesIO(content)
+
+        parts = urllib.parse.urlsplit(self.path)
+        if parts.path == monitoring.FIRST_FRAME:
+            try:
+                seconds = float(urllib.parse.parse_qs(parts.query)["seconds"][0])
+            except (KeyError, ValueError):
+                self.send_error(HTTPStatus.BAD_REQUEST, "seconds expected")
+                return None
+            METRICS.FIRST_FRAME.observe(seconds)
+            print(f"    -> first frame after {seconds:.3f}s ({THROTTLE or 'not throttled'})")
+            self.send_response(HTTPStatus.NO_CONTENT)
+            self.send_header("Cache-Control", "no-store")
+            self.end_headers()
+            return None
+
         f = None
         if os.path.isdir(path):
             parts = urllib.parse.urlsplit(self.path)
@@ -130,53 +400,42 @@ class CodeHandler(SimpleHTTPRequestHandler):
         if invalid and path.endswith(".map"):
             print(f"MAP? : {path}")
 
+        stored = None
+        origin_tag = ""
         if not os.path.isfile(path) and not invalid:
             remote_url = CDN + self.path
-            cache = hashlib.md5(remote_url.encode()).hexdigest()
-            d_cache = CACHE.joinpath(cache + ".data")
-            h_cache = CACHE.joinpath(cache + ".head")
-            if not h_cache.is_file():
-                if VERB:
-                    print("CACHING:", remote_url, "->", d_cache)
-                try:
-                    lf, headers = urllib.request.urlretrieve(remote_url, d_cache)
-                    h_cache.write_text(str(headers))
-                except:
-                    print("ERROR 404:", remote_url)
-
-            if d_cache.is_file():
-                if VERB:
-                    print("CACHED:", remote_url, "from", d_cache)
-                self.send_response(HTTPStatus.OK)
-                f = d_cache.open("rb")
-                with h_cache.open() as fh:
-                    while True:
-                        l = fh.readline()
-                        if l.find(": ") > 0:
-                            k, v = l.strip().split(": ", 1)
-                            k = k.lower()
-                            if k in [
-                                "content-length",
-                                "access-control-allow-origin",
-                                "cross-origin-embedder-policy",
-                                "cross-origin-resource-policy",
-                                "cross-origin-opener-policy",
-                            ]:
-                                continue
-                            self.send_header(k, v)
-                        else:
-                            break
-                    # we have a cache so not first time, be less verbose
-                    VERB = False
+            if VERB:
+                print("CACHING:", remote_url, "->", CACHE.paths(remote_url)[0])
+            hit = CACHE.key(remote_url) in CACHE.index
+            try:
+                # concurrent misses of an url share one download
+                f, entry, file_size = CACHE.stream(remote_url, upstream)
+            except Exception as e:
+                METRICS.CDN.inc("error")
+                print("ERROR 404:", remote_url, e)
+            else:
+                METRICS.CDN.inc("hit" if hit else "miss")
+                stored, origin_tag = stored_headers(entry)
+                # we have a cache so not first time, be less verbose
+                VERB = False
             cached = True
         else:
             cached = False
 
         if path.endswith(".apk"):
             if AUTO_REBUILD:
-                print()
-                AUTO_REBUILD()
-                print()
+                with REBUILD_LOCK:
+                    # a failed rebuild leaves them pending, for the next request to try again
+                    changed = WATCHER.pending() if WATCHER else None
+                    print()
+                    t0 = time.perf_counter()
+                    if not AUTO_REBUILD(changed):
+                        print(f"unchanged {self.path}")
+                    else:
+                        METRICS.REBUILD.observe(time.perf_counter() - t0)
+                    if WATCHER:
+                        WATCHER.done(changed)
+                    print()
             else:
                 print(f"{AUTO_REBUILD=} {path}")
 
@@ -191,51 +450,15 @@ class CodeHandler(SimpleHTTPRequestHandler):
             return None
 
         try:
-            fs = os.fstat(f.fileno())
-
-            # Use browser cache if possible
-            if not cached:
-                if "If-Modified-Since" in self.headers and "If-None-Match" not in self.headers:
-                    # compare If-Modified-Since and time of last file modification
-                    try:
-                        ims = email.utils.parsedate_to_datetime(self.headers["If-Modified-Since"])
-                    except (TypeError, IndexError, OverflowError, ValueError):
-                        # ignore ill-formed values
-                        pass
-                    else:
-                        if ims.tzinfo is None:
-                            # obsolete format with no timezone, cf.
-                            # https://tools.ietf.org/html/rfc7231#section-7.1.1.1
-                            ims = ims.replace(tzinfo=datetime.timezone.utc)
-                        if ims.tzinfo is datetime.timezone.utc:
-                            # compare to UTC datetime of last modification
-                            last_modif = datetime.datetime.fromtimestamp(fs.st_mtime, datetime.timezone.utc)
-                            # remove microseconds, like in If-Modified-Since
-                            last_modif = last_modif.replace(microsecond=0)
-
-                            if last_modif <= ims:
-                                self.send_response(HTTPStatus.NOT_MODIFIED)
-                                self.end_headers()
-                                f.close()
-                                return None
-
-                self.send_response(HTTPStatus.OK)
-
-                self.send_header("Content-type", ctype)
-
-            file_size = fs[6]
+            # a CDN file still downloading has no fstat
+            fs = os.fstat(f.fileno()) if hasattr(f, "fileno") else None
+            if fs:
+                file_size = fs.st_size
+            rewritten = None
 
             if path.endswith(".py"):
                 if VERB:
                     print(" --> do_GET(%s)" % path)
-                if fstring_decode:
-                    content, _ = fstring_decode(f.read())
-                    content = content.encode("UTF-8")
-                else:
-                    content = f.read()
-
-                file_size = len(content)
-                f = io.BytesIO(content)
 
             elif path.endswith(".json"):
                 if VERB:
@@ -243,27 +466,147 @@ class CodeHandler(SimpleHTTPRequestHandler):
                     print(self.path)
                     print()
 
-            elif path.endswith(".html"):
-                if VERB:
-                    print("REPLACING", path, CDN, PROXY)
-                content = f.read()
+            transform = TRANSFORMERS.get(os.path.splitext(path)[1].lower())
+            if transform:
+                rewritten = rewrite(f, fs, transform, path)
+                f.close()
+                file_size = rewritten.length
+                f = io.BytesIO(rewritten.content)
+                tag = rewritten.tag
+            elif origin_tag.startswith('"'):
+                # only a strong validator from origin is reused
+                tag = origin_tag
+            elif fs:
+                tag = etag(f.name, fs)
+            else:
+                tag = None
+
+            # precompressed build files, CDN and rewritten ones compressed here
+            encoding = None
+            compressible = compressing.compressible(path, file_size) and "content-encoding" not in (stored or {})
+            accepted = compressible and compressing.negotiate(self.headers.get("Accept-Encoding", ""))
+            if accepted:
+                token, suffix = accepted
+                encoded = None
+                if rewritten:
+                    content = rewritten.encode(token)
+                    if content is not None:
+                        f = io.BytesIO(content)
+                        file_size = len(content)
+                        encoding = token
+                elif fs and stored is not None:
+                    encoded = compressing.variant(f.name, token, suffix)
+                elif fs:
+                    sibling = Path(f.name + suffix)
+                    try:
+                        st = sibling.stat()
+                        if st.st_size and st.st_mtime_ns == fs.st_mtime_ns:
+                            encoded = sibling
+                    except OSError:
+                        pass
 
-                # redirect known CDN to relative path
-                # FIXME: py*-scripts
-                #                content = content.replace(
-                #                    b"https://pygame-web.github.io", b"http://localhost:8000"
-                #                )
+                if encoded:
+                    f.close()
+                    f = open(encoded, "rb")
+                    file_size = os.fstat(f.fileno()).st_size
+                    encoding = token
 
-                # redirect user CDN to localhost
-                content = content.replace(BCDN, BPROXY)
+            if encoding and tag:
+                tag = f'{tag[:-1]}-{encoding}"'
 
-                file_size = len(content)
-                f = io.BytesIO(content)
+            if stored is not None:
+                last_modified = stored.get("last-modified")
+            else:
+                last_modified = self.date_time_string(fs.st_mtime)
+
+            if tag and "If-None-Match" in self.headers:
+                # weak comparison
+                if self.headers["If-None-Match"].strip() == "*" or tag in [
+                    value.strip()[2:] if value.strip().startswith("W/") else value.strip()
+                    for value in self.headers["If-None-Match"].split(",")
+                ]:
+                    self.send_response(HTTPStatus.NOT_MODIFIED)
+                    self.send_header("ETag", tag)
+                    self.end_headers()
+                    f.close()
+                    return None
 
-            self.send_header("content-length", str(file_size))
+            # Use browser cache if possible
+            elif not cached and "If-Modified-Since" in self.headers and "If-None-Match" not in self.headers:
+                # compare If-Modified-Since and time of last file modification
+                try:
+                    ims = email.utils.parsedate_to_datetime(self.headers["If-Modified-Since"])
+                except (TypeError, IndexError, OverflowError, ValueError):
+                    # ignore ill-formed values
+                    pass
+                else:
+                    if ims.tzinfo is None:
+                        # obsolete format with no timezone, cf.
+                        # https://tools.ietf.org/html/rfc7231#section-7.1.1.1
+                        ims = ims.replace(tzinfo=datetime.timezone.utc)
+                    if ims.tzinfo is datetime.timezone.utc:
+                        # compare to UTC datetime of last modification
+                        last_modif = datetime.datetime.fromtimestamp(fs.st_mtime, datetime.timezone.utc)
+                        # remove microseconds, like in If-Modified-Since
+                        last_modif = last_modif.replace(microsecond=0)
+
+                        if last_modif <= ims:
+                            self.send_response(HTTPStatus.NOT_MODIFIED)
+                            self.end_headers()
+                            f.close()
+                            return None
+
+            ranges = None
+            if "Range" in self.headers and self.headers.get("If-Range", tag) in (tag, last_modified):
+                ranges = byte_ranges(self.headers["Range"], file_size)
+                if ranges == []:
+                    self.send_response(HTTPStatus.REQUESTED_RANGE_NOT_SATISFIABLE)
+                    self.send_header("Content-Range", f"bytes */{file_size}")
+                    self.send_header("content-length", "0")
+                    self.end_headers()
+                    f.close()
+                    return None
+
+            if ranges:
+                self.send_response(HTTPStatus.PARTIAL_CONTENT)
+            else:
+                self.send_response(HTTPStatus.OK)
 
-            if not cached:
-                self.send_header("Last-Modified", self.date_time_string(fs.st_mtime))
+            if stored is not None:
+                for k, v in stored.items():
+                    if not (ranges and len(ranges) > 1 and k == "content-type"):
+                        self.send_header(k, v)
+            else:
+                if not (ranges and len(ranges) > 1):
+                    self.send_header("Content-type", ctype)
+                self.send_header("Last-Modified", last_modified)
+
+            if ranges and len(ranges) == 1:
+                start, end = ranges[0]
+                self.send_header("Content-Range", f"bytes {start}-{end}/{file_size}")
+                f = Slices(f, [(start, end - start + 1)])
+                file_size = end - start + 1
+
+            elif ranges:
+                boundary = hashlib.md5(f"{tag}{self.headers['Range']}".encode()).hexdigest()
+                ctype = stored.get("content-type", ctype) if stored else ctype
+                self.send_header("Content-Type", f"multipart/byteranges; boundary={boundary}")
+                items = []
+                for start, end in ranges:
+                    items.append(f"\r\n--{boundary}\r\nContent-Type: {ctype}\r\nContent-Range: bytes {start}-{end}/{file_size}\r\n\r\n".encode())
+                    items.append((start, end - start + 1))
+                items.append(f"\r\n--{boundary}--\r\n".encode())
+                f = Slices(f, items)
+                file_size = f.size()
+
+            if encoding:
+                self.send_header("Content-Encoding", encoding)
+            if compressible:
+                self.send_header("Vary", "Accept-Encoding")
+            self.send_header("content-length", str(file_size))
+            self.send_header("Accept-Ranges", "bytes")
+            if tag:
+                self.send_header("ETag", tag)
 
             self.end_headers()
 
@@ -272,7 +615,6 @@ class CodeHandler(SimpleHTTPRequestHandler):
             f.close()
             raise
 
-
 def code_server(
     HandlerClass,
     ServerClass=ThreadingHTTPServer,
@@ -316,9 +658,200 @@ def code_server(
             httpd.serve_forever()
         except KeyboardInterrupt:
             print("\nKeyboard interrupt received, exiting.")
+            print(monitoring.summary())
             sys.exit(0)
 
 
+# asyncio server : HTTP/1.1 keep-alive, pipelined requests are prepared
+# concurrently by CodeHandler in worker threads and answered in order,
+# files go with loop.sendfile unless throttled.
+
+# requests of one connection being prepared ahead of their response
+PIPELINE = 8
+
+
+class Exchange(CodeHandler):
+    """CodeHandler for one request already parsed by the asyncio server, response head is buffered"""
+
+    protocol_version = "HTTP/1.1"
+
+    def __init__(self, directory, client_address, requestline, headers):
+        self.directory = os.fspath(directory)
+        self.client_address = client_address
+        self.requestline = requestline
+        self.headers = headers
+        self.wfile = io.BytesIO()
+        self.close_connection = False
+        self.length = 0
+        self.command, self.path, self.request_version = (requestline.split() + [None, None, "HTTP/0.9"])[:3]
+
+    def keep_alive(self):
+        conntype = self.headers.get("Connection", "").lower()
+        if self.close_connection or conntype == "close":
+            return False
+        return self.request_version == "HTTP/1.1" or conntype == "keep-alive"
+
+    def respond(self):
+        """(response head, body file or None)"""
+        if len(self.requestline.split()) != 3 or not self.request_version.startswith("HTTP/1."):
+            self.command = "GET"
+            self.send_error(HTTPStatus.BAD_REQUEST, f"Bad request ({self.requestline!r})")
+            self.close_connection = True
+            f = None
+        elif self.command not in ("GET", "HEAD"):
+            self.send_error(HTTPStatus.NOT_IMPLEMENTED, f"Unsupported method ({self.command!r})")
+            f = None
+        else:
+            f = self.send_head()
+            if f and self.command == "HEAD":
+                f.close()
+                f = None
+        head = self.wfile.getvalue()
+        # eg redirects, without a length only closing the connection ends the body
+        if head.lower().find(b"\r\ncontent-length:") < 0 and not head.startswith((b"HTTP/1.1 304", b"HTTP/1.1 204")):
+            self.close_connection = True
+        return head, f
+
+
+async def serve_client(reader, writer, directory):
+    loop = asyncio.get_running_loop()
+    peer = writer.get_extra_info("peername")
+    pending = asyncio.Queue(PIPELINE)
+    bucket = THROTTLE.bucket() if THROTTLE else None
+
+    async def send(data):
+        if not bucket:
+            writer.write(data)
+            return
+        view = memoryview(data)
+        for pos in range(0, len(view), throttling.CHUNK):
+            chunk = view[pos : pos + throttling.CHUNK]
+            await asyncio.sleep(bucket.take(len(chunk)))
+            writer.write(chunk)
+            await writer.drain()
+
+    async def read_requests():
+        if THROTTLE:
+            # connection handshake
+            await asyncio.sleep(THROTTLE.delay())
+        try:
+            while True:
+                try:
+                    head = await reader.readuntil(b"\r\n\r\n")
+                except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+                    break
+                requestline, _, fields = head.partition(b"\r\n")
+                exchange = Exchange(directory, peer, requestline.decode("latin-1").strip(), http.client.parse_headers(io.BytesIO(fields)))
+
+                # no upload here, skip any body
+                length = int(exchange.headers.get("Content-Length", 0) or 0)
+                if length:
+                    await reader.readexactly(length)
+
+                await pending.put((exchange, time.perf_counter(), loop.run_in_executor(None, exchange.respond)))
+                if not exchange.keep_alive():
+                    break
+        finally:
+            await pending.put(None)
+
+    def discard(future):
+        if not future.cancelled() and not future.exception():
+            head, f = future.result()
+            if f:
+                f.close()
+
+    reading = asyncio.create_task(read_requests())
+    try:
+        while True:
+            item = await pending.get()
+            if item is None:
+                break
+            exchange, t0, future = item
+            head, f = await future
+            try:
+                if THROTTLE:
+                    # latency counts from the request, pipelined ones overlap
+                    await asyncio.sleep(t0 + THROTTLE.delay() - time.perf_counter())
+                await send(head)
+                if isinstance(f, io.BytesIO):
+                    await send(f.getvalue())
+                elif not bucket and isinstance(f, Slices) and isinstance(f.file, io.BufferedReader):
+                    for item in f.items:
+                        if isinstance(item, bytes):
+                            writer.write(item)
+                        else:
+                            await writer.drain()
+                            await loop.sendfile(writer.transport, f.file, *item)
+                elif not bucket and isinstance(f, io.BufferedReader):
+                    await writer.drain()
+                    await loop.sendfile(writer.transport, f, f.tell())
+                elif f:
+                    # CDN files being downloaded, parts of memory ones, or paced ones
+                    while True:
+                        chunk = await loop.run_in_executor(None, f.read, 1 << 16)
+                        if not chunk:
+                            break
+                        await send(chunk)
+                        await writer.drain()
+                await writer.drain()
+            finally:
+                if f:
+                    f.close()
+            METRICS.REQUEST.observe(time.perf_counter() - t0)
+            METRICS.SENT.observe(exchange.length if exchange.command != "HEAD" else 0)
+            if not exchange.keep_alive():
+                break
+    except ConnectionError:
+        pass
+    finally:
+        reading.cancel()
+        while not pending.empty():
+            item = pending.get_nowait()
+            if item:
+                item[2].add_done_callback(discard)
+        writer.close()
+
+
+async def async_serve(directory, port=8000, bind="localhost", context=None, ready=None):
+    server = await asyncio.start_server(partial(serve_client, directory=directory), bind, port, ssl=context)
+    host, port = server.sockets[0].getsockname()[:2]
+    scheme = "https" if context else "http"
+    print(f"Serving {scheme.upper()} (asyncio) on {host} port {port} ({scheme}://{bind}:{port}/) ...")
+    if ready:
+        ready(server)
+    async with server:
+        await server.serve_forever()
+
+
+def async_code_server(directory, port=8000, bind="localhost", ssl=False):
+    """
+    This runs an asyncio HTTP/1.1 server on port 8000 (or the port argument).
+    """
+
+    context = None
+    if ssl:
+        try:
+            import ssl as modssl
+
+            context = modssl.SSLContext(modssl.PROTOCOL_TLS_SERVER)
+            context.load_cert_chain(certfile="server.pem", keyfile="key.pem")
+        except Exception as e:
+            print("can't start ssl", e)
+            print("maybe 'openssl req -new -x509 -keyout key.pem -out server.pem -days 3650 -nodes'")
+            context = None
+
+    # the caller may already run a loop
+    thread = threading.Thread(target=asyncio.run, args=(async_serve(directory, port, bind, context),), daemon=True)
+    thread.start()
+    try:
+        while thread.is_alive():
+            thread.join(1)
+    except KeyboardInterrupt:
+        print("\nKeyboard interrupt received, exiting.")
+        print(monitoring.summary())
+        sys.exit(0)
+
+
 if not ".wasm" in CodeHandler.extensions_map:
     print(
         "WARNING: wasm mimetype unsupported on that system, trying to correct",
@@ -327,15 +860,23 @@ if not ".wasm" in CodeHandler.extensions_map:
     CodeHandler.extensions_map[".wasm"] = "application/wasm"
 
 
-def run_code_server(args, cc):
-    global CACHE, CDN, PROXY, BCDN, BPROXY
-    CACHE = Path(args.cache)
+def run_code_server(args, cc, cdn_cache=None):
+    global CACHE, CDN, PROXY, BCDN, BPROXY, WATCHER, THROTTLE
+    CACHE = cdn_cache or CdnCache(args.cdn_cache, args.version)
+    print(f"    -> {CACHE.load_index()} CDN file(s) indexed in {CACHE.root}")
+    if getattr(args, "throttle", None):
+        THROTTLE = throttling.parse(args.throttle)
+        print(f"    -> throttled to {args.throttle} : {THROTTLE}")
     CDN = "/".join(args.cdn.split("/")[0:3])
     PROXY = cc["proxy"]
 
     BCDN = CDN.encode("utf-8")
     BPROXY = PROXY.encode("utf-8")
 
+    # the proxy downloads through web.POOL, as the build did
+    if CDN.startswith("https:") and web.POOL.context().verify_mode == web.ssl.CERT_NONE:
+        print(f"    -> CDN proxy not verifying {CDN} certificates (--no_ssl_check)")
+
     ssl = args.ssl
     if ssl:
         try:
@@ -347,5 +888,14 @@ def run_code_server(args, cc):
             ssl = False
     else:
         print("Not using SSL")
-    handler_class = partial(CodeHandler, directory=args.directory)
-    code_server(HandlerClass=handler_class, port=args.port, bind=args.bind, ssl=ssl)
+    if AUTO_REBUILD and pack.REPLAY.MATCHER:
+        from .watching import Watcher
+
+        WATCHER = Watcher(pack.REPLAY.TARGET, pack.REPLAY.MATCHER)
+        print(f"watching {pack.REPLAY.TARGET} for changes ({WATCHER.mode})")
+
+    if getattr(args, "server", "thread") == "asyncio":
+        async_code_server(args.directory, port=args.port, bind=args.bind, ssl=ssl)
+    else:
+        handler_class = partial(CodeHandler, directory=args.directory)
+        code_server(HandlerClass=handler_class, port=args.port, bind=args.bind, ssl=ssl)
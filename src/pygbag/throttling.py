@@ -0,0 +1,99 @@
+"""
+network conditions for the test server ( --throttle ) : every connection
+pays a round trip to open, every response waits the latency, and bytes
+are paced by a token bucket per connection.
+
+a profile is a name from PROFILES or "latency=150,bandwidth=1600,jitter=20"
+with latency and jitter in ms and bandwidth in kbit/s.
+"""
+
+import random
+import threading
+import time
+
+# latency ms, bandwidth kbit/s, jitter ms : devtools presets, and a good link
+PROFILES = {
+    "slow3g": (2000, 400, 200),
+    "3g": (563, 1440, 60),
+    "4g": (150, 9000, 20),
+    "lan": (2, 100000, 1),
+}
+
+# bytes written at once, a few tcp segments
+CHUNK = 4096
+
+
+class Throttle:
+    def __init__(self, latency=0, bandwidth=0, jitter=0):
+        self.latency = latency / 1000
+        self.jitter = jitter / 1000
+        # bytes per second, 0 is not limited
+        self.rate = bandwidth * 1000 / 8
+
+    def __str__(self):
+        return f"latency {self.latency * 1000:g}ms, bandwidth {self.rate * 8 / 1000:g}kbit/s, jitter {self.jitter * 1000:g}ms"
+
+    def delay(self):
+        """latency of a request, with jitter"""
+        return max(0.0, self.latency + random.uniform(-self.jitter, self.jitter))
+
+    def bucket(self):
+        return TokenBucket(self.rate, max(CHUNK, self.rate * 0.05))
+
+
+def parse(spec):
+    """Throttle of a --throttle argument, raises ValueError"""
+    spec = spec.strip().lower()
+    if spec in PROFILES:
+        return Throttle(*PROFILES[spec])
+    values = {}
+    for item in spec.split(","):
+        name, sep, value = item.partition("=")
+        name = name.strip()
+        if not sep or name not in ("latency", "bandwidth", "jitter"):
+            raise ValueError(f"--throttle {spec} : use one of {', '.join(PROFILES)} or latency=ms,bandwidth=kbit/s,jitter=ms")
+        values[name] = float(value)
+    return Throttle(**values)
+
+
+class TokenBucket:
+    """rate bytes per second, allowing bursts up to burst bytes"""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.last = time.monotonic()
+        self.lock = threading.Lock()
+
+    def take(self, size):
+        """seconds to wait before sending size bytes"""
+        if not self.rate:
+            return 0.0
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.last) * self.rate)
+            self.last = now
+            self.tokens -= size
+            return -self.tokens / self.rate if self.tokens < 0 else 0.0
+
+
+class Paced:
+    """file object writing through a TokenBucket, for the thread server sockets"""
+
+    def __init__(self, wfile, bucket):
+        self.wfile = wfile
+        self.bucket = bucket
+
+    def write(self, data):
+        view = memoryview(data)
+        for pos in range(0, len(view), CHUNK):
+            chunk = view[pos : pos + CHUNK]
+            wait = self.bucket.take(len(chunk))
+            if wait:
+                time.sleep(wait)
+            self.wfile.write(chunk)
+        return len(view)
+
+    def __getattr__(self, name):
+        return getattr(self.wfile, name)
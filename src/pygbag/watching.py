@@ -0,0 +1,169 @@
+"""
+app folder watcher for the test server : changed files are collected so the
+apk is only repacked when something did change.
+
+inotify is used on linux, elsewhere (or when out of watches) the packed
+files mtime and size are polled.
+"""
+
+import ctypes
+import os
+import struct
+import sys
+import threading
+import time
+from pathlib import Path
+
+from .gathering import walk
+
+IN_MODIFY = 0x2
+IN_ATTRIB = 0x4
+IN_CLOSE_WRITE = 0x8
+IN_MOVED_FROM = 0x40
+IN_MOVED_TO = 0x80
+IN_CREATE = 0x100
+IN_DELETE = 0x200
+IN_DELETE_SELF = 0x400
+IN_ISDIR = 0x40000000
+IN_IGNORED = 0x8000
+IN_CLOEXEC = 0o2000000
+
+MASK = IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF
+
+EVENT = struct.Struct("iIII")
+
+
+def generated(rel):
+    # optimizer output, regenerated at each build from its source.
+    return rel.find("-pygbag.") >= 0
+
+
+class Watcher:
+    def __init__(self, root, matcher, interval=1.0):
+        self.root = Path(root)
+        self.matcher = matcher
+        self.interval = interval
+        self.changed = set()
+        self.lock = threading.Lock()
+        self.mode = None
+
+        self.libc = None
+        self.fd = -1
+        self.wds = {}
+        if sys.platform == "linux":
+            try:
+                self.libc = ctypes.CDLL(None, use_errno=True)
+                self.fd = self.libc.inotify_init1(IN_CLOEXEC)
+            except (OSError, AttributeError):
+                self.fd = -1
+
+        if self.fd >= 0:
+            try:
+                self.add_tree("/")
+                self.mode = "inotify"
+            except OSError as e:
+                print(f"inotify unavailable ({e}), polling {self.root}")
+                os.close(self.fd)
+                self.fd = -1
+
+        if self.mode is None:
+            self.mode = "polling"
+            self.snapshot = self.scan()
+
+        threading.Thread(target=self.inotify if self.fd >= 0 else self.poll, daemon=True).start()
+
+    def mark(self, rel):
+        if not generated(rel):
+            with self.lock:
+                self.changed.add(rel)
+
+    def pending(self):
+        """changed files relative to root not yet done, as "/img/a.png" """
+        with self.lock:
+            return set(self.changed)
+
+    def done(self, changed):
+        """changes from pending() are handled, those seen since are kept"""
+        with self.lock:
+            self.changed -= changed
+
+    # inotify
+
+    def add_tree(self, rel):
+        stack = [rel]
+        while stack:
+            rel = stack.pop()
+            folder = self.root.joinpath(rel[1:])
+            wd = self.libc.inotify_add_watch(self.fd, os.fsencode(folder), MASK)
+            if wd < 0:
+                errno = ctypes.get_errno()
+                raise OSError(errno, f"inotify_add_watch {folder} : {os.strerror(errno)}")
+            self.wds[wd] = rel
+            try:
+                with os.scandir(folder) as entries:
+                    for entry in entries:
+                        if entry.is_dir() and not entry.is_symlink():
+                            sub = f"{rel.rstrip('/')}/{entry.name}"
+                            if not self.matcher.skip_dir(sub):
+                                stack.append(sub)
+            except OSError:
+                pass
+
+    def inotify(self):
+        while True:
+            try:
+                data = os.read(self.fd, 1 << 16)
+            except OSError as e:
+                print(f"watcher stopped : {e}")
+                return
+            pos = 0
+            while pos < len(data):
+                wd, mask, cookie, size = EVENT.unpack_from(data, pos)
+                pos += EVENT.size
+                name = os.fsdecode(data[pos : pos + size].rstrip(b"\0"))
+                pos += size
+
+                folder = self.wds.get(wd)
+                if folder is None:
+                    continue
+                if mask & IN_IGNORED:
+                    self.wds.pop(wd, None)
+                    continue
+
+                rel = f"{folder.rstrip('/')}/{name}" if name else folder
+                if mask & IN_ISDIR:
+                    if self.matcher.skip_dir(rel):
+                        continue
+                    if mask & (IN_CREATE | IN_MOVED_TO):
+                        try:
+                            self.add_tree(rel)
+                        except OSError as e:
+                            print(f"cannot watch {rel} : {e}")
+                    # files appear or vanish with it
+                    self.mark(rel)
+                elif not self.matcher.skip_file(rel):
+                    self.mark(rel)
+
+    # polling
+
+    def scan(self):
+        snapshot = {}
+        for folder, filename in walk(self.root, self.matcher):
+            rel = filename.as_posix()
+            try:
+                st = os.stat(self.root.joinpath(rel[1:]))
+            except OSError:
+                continue
+            snapshot[rel] = (st.st_mtime_ns, st.st_size)
+        return snapshot
+
+    def poll(self):
+        while True:
+            time.sleep(self.interval)
+            snapshot = self.scan()
+            for rel in set(snapshot).symmetric_difference(self.snapshot):
+                self.mark(rel)
+            for rel, stamp in snapshot.items():
+                if self.snapshot.get(rel, stamp) != stamp:
+                    self.mark(rel)
+            self.snapshot = snapshot
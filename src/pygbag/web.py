@@ -1,7 +1,11 @@
 import os
 import os.path
 
+import http.client
+import random
+import threading
 import urllib
+import urllib.parse
 import urllib.request
 
 import time
@@ -68,42 +72,289 @@ def fixcert():
     print(" -- update complete")
 
 
-def get(url, path):
-    error = None
-    data_file = None
-    try:
-        print(f'urllib.request.urlretrieve("{url}", "{path}")')
-        while data_file is None:
-            try:
-                data_file, header = urllib.request.urlretrieve(url, path)
+# retries of a failed download, waiting BACKOFF * 2**n seconds up to BACKOFF_MAX
+RETRIES = 7
+BACKOFF = 0.5
+BACKOFF_MAX = 30
+
+# concurrent downloads of --prefetch
+JOBS = 4
+
+# runtime files for a --PYBUILD, relative to cdn. {pydigits} is "312" for 3.12
+RUNTIME = (
+    "pythons.js",
+    "browserfs.min.js",
+    "vt.js",
+    "vtx.js",
+    "vt/xterm.js",
+    "vt/xterm.css",
+    "vt/xterm-addon-image.js",
+    "pythonrc.py",
+    "cpythonrc.py",
+    "empty.html",
+    "empty.ogg",
+    "cpython{pydigits}/main.js",
+    "cpython{pydigits}/main.wasm",
+    "cpython{pydigits}/main.data",
+)
+
+
+def runtime(cdn, pybuild):
+    """urls of the files a page loads from cdn for PYBUILD"""
+    return [cdn + name.format(pydigits=pybuild.replace(".", "")) for name in RUNTIME]
+
+
+class Pool:
+    """keep-alive connections, reused by host"""
+
+    def __init__(self, timeout=30, idle=8):
+        self.timeout = timeout
+        self.idle = idle
+        self.connections = {}
+        self.lock = threading.Lock()
+
+    def connect(self, scheme, netloc):
+        with self.lock:
+            idle = self.connections.get((scheme, netloc))
+            if idle:
+                return idle.pop()
+        if scheme == "https":
+            return http.client.HTTPSConnection(netloc, timeout=self.timeout, context=self.context())
+        return http.client.HTTPConnection(netloc, timeout=self.timeout)
+
+    def context(self):
+        """ssl context of new connections, the default one which --no_ssl_check replaces"""
+        return ssl._create_default_https_context()
 
-            except urllib.error.HTTPError as e:
-                error = e
+    def release(self, scheme, netloc, conn):
+        with self.lock:
+            idle = self.connections.setdefault((scheme, netloc), [])
+            if len(idle) < self.idle:
+                idle.append(conn)
+                return
+        conn.close()
 
-            except urllib.error.URLError as e:
-                error = e
+    def close(self):
+        with self.lock:
+            for idle in self.connections.values():
+                while idle:
+                    idle.pop().close()
 
-            except ssl.SSLCertVerificationError:
-                print("Trying to fix certificate error")
-                fixcert()
+    def request(self, url, headers, redirects=5):
+        """
+        GET url, returns (response, release) where release() gives the connection
+        back once the body was read. Redirects are followed.
+        """
+        for _ in range(redirects + 1):
+            parts = urllib.parse.urlsplit(url)
+            target = parts.path or "/"
+            if parts.query:
+                target += "?" + parts.query
+
+            # an idle connection may have been closed by server, retry once on a new one
+            for reused in (True, False):
+                conn = self.connect(parts.scheme, parts.netloc) if reused else None
+                conn = conn or self.connect(parts.scheme, parts.netloc)
+                try:
+                    conn.request("GET", target, headers=headers)
+                    response = conn.getresponse()
+                    break
+                except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+                    conn.close()
+                    if not reused:
+                        raise
+                except Exception:
+                    conn.close()
+                    raise
+
+            if response.status in (301, 302, 303, 307, 308) and response.getheader("Location"):
+                response.read()
+                self.release(parts.scheme, parts.netloc, conn)
+                url = urllib.parse.urljoin(url, response.getheader("Location"))
                 continue
 
-            if data_file is not None:
-                break
+            def release():
+                if response.will_close:
+                    conn.close()
+                else:
+                    self.release(parts.scheme, parts.netloc, conn)
+
+            return response, release
+
+        raise urllib.error.HTTPError(url, 310, "too many redirects", None, None)
+
 
-            if error:
-                print(f"WARNING: web.get({url}) : {error}")
+POOL = Pool()
 
-            time.sleep(5)
-            print("retrying in 5 seconds")
 
-    finally:
-        if data_file is not None:
-            return Path(data_file), header
+def validator(headers):
+    """strong ETag or Last-Modified of a response, for If-Range"""
+    etag = headers.get("ETag", "")
+    if etag and not etag.startswith("W/"):
+        return etag
+    return headers.get("Last-Modified", "")
+
+
+def download(url, path, partial=None, pool=None):
+    """
+    GET url to path, returns (path, headers). With a partial file, what an
+    interrupted download left there is resumed by a range request, if the
+    url content did not change since : its validator is kept in <partial>.if-range
+    """
+    pool = pool or POOL
+    target = Path(partial or path)
+    offset = target.stat().st_size if partial and target.is_file() else 0
+
+    request = {}
+    if partial:
+        known = target.with_name(f"{target.name}.if-range")
+        try:
+            request = {"Range": f"bytes={offset}-", "If-Range": known.read_text().strip()} if offset else {}
+        except OSError:
+            # nothing tells the partial content is still current
+            pass
+        if not request.get("If-Range"):
+            request = {}
+            offset = 0
+
+    response, release = pool.request(url, request)
+    try:
+        if offset and response.status == 206 and response.getheader("Content-Range", "").startswith(f"bytes {offset}-"):
+            mode = "ab"
+        elif response.status == 200:
+            # new or changed content, from the start
+            mode = "wb"
+            if partial:
+                tag = validator(response.msg)
+                if tag:
+                    known.write_text(tag)
+                elif known.exists():
+                    known.unlink()
+        else:
+            response.read()
+            if response.status == 416:
+                # partial is stale or complete, start over
+                target.unlink()
+            raise urllib.error.HTTPError(url, response.status, response.reason, response.msg, None)
+
+        with open(target, mode) as file:
+            while True:
+                chunk = response.read(1 << 16)
+                if not chunk:
+                    break
+                file.write(chunk)
+
+        if response.length:
+            raise http.client.IncompleteRead(b"", response.length)
+    except Exception:
+        response.close()
+        raise
+    release()
+
+    headers = response.msg
+    # what is kept describes the whole file
+    del headers["Content-Range"]
+    if partial:
+        os.replace(target, path)
+        if known.exists():
+            known.unlink()
+    return Path(path), headers
+
+
+def stream(url, pool=None):
+    """(headers, length or None, chunks) of url, chunks iterates over the body as it arrives"""
+    pool = pool or POOL
+    response, release = pool.request(url, {})
+    if response.status != 200:
+        response.read()
+        release()
+        raise urllib.error.HTTPError(url, response.status, response.reason, response.msg, None)
+
+    def chunks():
+        try:
+            while True:
+                chunk = response.read(1 << 16)
+                if not chunk:
+                    break
+                yield chunk
+        except BaseException:
+            response.close()
+            raise
+        release()
+
+    return response.msg, response.length, chunks()
+
+
+def retry(fn, url, attempts=RETRIES):
+    """fn() until it does not fail with a network or server error"""
+    fixed = False
+    attempt = 0
+    while True:
+        try:
+            return fn()
+        except ssl.SSLCertVerificationError:
+            if fixed:
+                raise
+            print("Trying to fix certificate error")
+            fixcert()
+            fixed = True
+            # not an attempt, even the last one is tried again once fixed
+            continue
+        except urllib.error.HTTPError as e:
+            # client errors will not go away
+            if e.code < 500 and e.code not in (408, 416, 429):
+                raise
+            error = e
+        except (OSError, http.client.HTTPException) as e:
+            error = e
+
+        if attempt >= attempts - 1:
+            raise error
+        delay = min(BACKOFF * 2**attempt, BACKOFF_MAX) * random.uniform(0.5, 1)
+        attempt += 1
+        print(f"WARNING: web.get({url}) : {error}, retrying in {delay:.1f} seconds")
+        time.sleep(delay)
+
+
+def get(url, path, attempts=RETRIES):
+    print(f'web.get("{url}", "{path}")')
+    try:
+        return retry(lambda: download(url, path), url, attempts)
+    except Exception as e:
         # this is normal in dev mode for favicon and templates because
         # proxy is not yet started.
         print(f"NO DATA RECEIVED FOR {url}")
-        raise Exception(f"cannot cache {url} to {path}")
+        raise Exception(f"cannot cache {url} to {path}") from e
+
+
+def prefetch(urls, cache, jobs=JOBS, attempts=RETRIES):
+    """
+    download missing urls in caching.CdnCache cache, jobs at a time over
+    pooled connections. Returns (fetched, failed) urls.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    def fetch(url):
+        def retrieve(url, tmp):
+            with cache.partial(url) as partial:
+                return retry(lambda: download(url, tmp, partial), url, attempts)
+
+        cache.fetch(url, retrieve)
+
+    todo = [url for url in urls if not cache.get(url)]
+    fetched = []
+    failed = []
+    with ThreadPoolExecutor(max(1, jobs)) as executor:
+        for url, future in [(url, executor.submit(fetch, url)) for url in todo]:
+            try:
+                future.result()
+                fetched.append(url)
+            except Exception as e:
+                print(f"ERROR: prefetch {url} : {e}")
+                failed.append(url)
+
+    print(f"    -> {len(urls) - len(todo)} file(s) already cached, {len(fetched)} fetched, {len(failed)} failed")
+    return fetched, failed
 
 
 if __name__ == "__main__":
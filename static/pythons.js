@@ -280,10 +280,16 @@ function DEPRECATED_wget_sync(url, store){
     const request = new XMLHttpRequest();
     try {
         request.open('GET', url, false);
+        // sync XHR cannot use arraybuffer, keep bytes as they are in the string
+        request.overrideMimeType('text/plain; charset=x-user-defined');
         request.send(null);
         if (request.status === 200) {
             console.log(`DEPRECATED_wget_sync(${url})`);
-            FS.writeFile( store, request.responseText);
+            const text = request.responseText
+            const data = new Uint8Array(text.length)
+            for (let i = 0; i < text.length; i++)
+                data[i] = text.charCodeAt(i) & 0xff
+            FS.writeFile( store, data);
         }
         return request.status
     } catch (ex) {
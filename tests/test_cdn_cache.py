@@ -0,0 +1,161 @@
+"""
+CdnCache.stream against a slow local origin : one upstream request per miss,
+readers following the file being written, errors reaching every waiter.
+
+    python -m pytest tests/test_cdn_cache.py
+"""
+
+import sys
+import threading
+import time
+import urllib.error
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "src"))
+
+from pygbag import web
+from pygbag.caching import CdnCache
+
+BODY = bytes(range(256)) * 1024
+CLIENTS = 6
+
+
+class Origin(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    # path -> requests seen
+    requests = {}
+    # body is held at half until set, error answered once set
+    release = threading.Event()
+    # path -> status to answer instead of the body, once
+    failures = {}
+
+    def log_message(self, *argv):
+        pass
+
+    def do_GET(self):
+        Origin.requests[self.path] = Origin.requests.get(self.path, 0) + 1
+        status = Origin.failures.pop(self.path, None)
+        if status:
+            Origin.release.wait(10)
+            self.send_response(status)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "application/octet-stream")
+        self.send_header("Content-Length", str(len(BODY)))
+        self.end_headers()
+        half = len(BODY) // 2
+        for pos in range(0, half, 16384):
+            self.wfile.write(BODY[pos : pos + 16384])
+            self.wfile.flush()
+            time.sleep(0.01)
+        Origin.release.wait(10)
+        self.wfile.write(BODY[half:])
+
+
+@pytest.fixture
+def origin():
+    Origin.requests.clear()
+    Origin.failures.clear()
+    Origin.release.clear()
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Origin)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+    Origin.release.set()
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return CdnCache(tmp_path, "test")
+
+
+def opener(pool):
+    return lambda url: web.stream(url, pool)
+
+
+def test_concurrent_misses_fetch_once_and_follow(origin, cache):
+    url = f"{origin}/runtime.wasm"
+    pool = web.Pool()
+    heads = []
+
+    def client():
+        f, headers, size = cache.stream(url, opener(pool))
+        try:
+            # the origin holds the second half until every client read the first bytes
+            head = f.read(4096)
+            heads.append(head)
+            while len(heads) < CLIENTS:
+                time.sleep(0.01)
+            Origin.release.set()
+            data = head
+            while len(data) < size:
+                chunk = f.read(65536)
+                assert chunk
+                data += chunk
+            return size, data
+        finally:
+            f.close()
+
+    with ThreadPoolExecutor(CLIENTS) as executor:
+        results = list(executor.map(lambda _: client(), range(CLIENTS)))
+
+    assert Origin.requests == {"/runtime.wasm": 1}
+    for size, data in results:
+        assert size == len(BODY)
+        assert data == BODY
+
+    # now a hit, from the cache file
+    f, headers, size = cache.stream(url, opener(pool))
+    try:
+        assert f.read() == BODY
+    finally:
+        f.close()
+    assert Origin.requests == {"/runtime.wasm": 1}
+    pool.close()
+
+
+def test_upstream_error_reaches_waiters_then_retries(origin, cache):
+    url = f"{origin}/pythons.js"
+    pool = web.Pool()
+    Origin.failures["/pythons.js"] = 503
+    errors = []
+
+    def client():
+        try:
+            cache.stream(url, opener(pool))
+        except urllib.error.HTTPError as e:
+            errors.append(e.code)
+
+    threads = [threading.Thread(target=client) for _ in range(CLIENTS)]
+    for thread in threads:
+        thread.start()
+    # every client waits on the same download before the origin answers
+    deadline = time.monotonic() + 5
+    while not cache.flights and time.monotonic() < deadline:
+        time.sleep(0.01)
+    time.sleep(0.2)
+    Origin.release.set()
+    for thread in threads:
+        thread.join(10)
+
+    assert Origin.requests == {"/pythons.js": 1}
+    assert errors == [503] * CLIENTS
+    assert not cache.flights
+
+    # the failure is not cached, next request downloads again
+    f, headers, size = cache.stream(url, opener(pool))
+    try:
+        assert f.read() == BODY
+    finally:
+        f.close()
+    assert Origin.requests == {"/pythons.js": 2}
+    pool.close()